@@ -0,0 +1,1208 @@
+# -*- coding: utf-8 -*-
+# PEP8:OK, LINT:OK, PY3:OK
+
+
+#############################################################################
+## This file may be used under the terms of the GNU General Public
+## License version 2.0 or 3.0 as published by the Free Software Foundation
+## and appearing in the file LICENSE.GPL included in the packaging of
+## this file.  Please review the following information to ensure GNU
+## General Public Licensing requirements will be met:
+## http:#www.fsf.org/licensing/licenses/info/GPLv2.html and
+## http:#www.gnu.org/copyleft/gpl.html.
+##
+## This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+## WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#############################################################################
+
+
+# metadata
+' Vagrant Ninja generator, renders and runs VMs without Qt nor Ninja-IDE '
+from __future__ import print_function
+__version__ = ' 2.6 '
+__license__ = ' GPL '
+__author__ = ' juancarlospaco '
+__email__ = ' juancarlospaco@ubuntu.com '
+__url__ = 'github.com/juancarlospaco'
+__date__ = '10/10/2013'
+__prj__ = 'vagrant'
+__docformat__ = 'html'
+__source__ = ''
+__full_licence__ = ''
+
+
+# imports
+from os import (environ, chmod, remove, path, makedirs, pathsep, access,
+    X_OK, rename, sysconf, listdir, rmdir, symlink)
+from datetime import datetime
+from time import time, sleep
+from json import dump, dumps, load, loads
+from re import compile as regex
+from subprocess import STDOUT, Popen, PIPE
+from getpass import getuser
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+from hashlib import sha256
+from glob import glob
+from itertools import chain
+from codecs import open as codecs_open, getincrementaldecoder
+from argparse import ArgumentParser
+from uuid import uuid4
+
+try:
+    from urllib2 import urlopen, Request, HTTPError
+except ImportError:
+    from urllib.request import urlopen, Request  # lint:ok
+    from urllib.error import HTTPError  # lint:ok
+
+try:
+    import yaml
+except ImportError:
+    yaml = None  # only needed for .yml manifests
+
+
+# constans
+VBOXGUI = '''
+    config.vm.provider :virtualbox do |vb|
+        vb.gui = {}  # false for NO GUI
+        vb.customize ["modifyvm", :id, "--memory", "{}"]  # RAM for VM
+        vb.customize ["modifyvm", :id, "--cpuexecutioncap", "{}"]  # CPU for VM
+        vb.customize ["modifyvm", :id, "--cpus", "{}"]  # CPU cores for VM
+{}    end
+'''
+
+LINKED = '''        vb.linked_clone = true  # a delta disk of the golden image
+'''
+
+GOLDENSH = ('vagrant up && vagrant halt && vagrant package --output '
+            'golden.part && mv golden.part golden.box && vagrant destroy -f')
+
+APTGET_PROXY = '''# proxy support for the VM
+echo "Acquire::http::Proxy 'http://{}';" | tee /etc/apt/apt.conf.d/99proxy
+echo "Acquire::https::Proxy 'https://{}';" >> /etc/apt/apt.conf.d/99proxy
+echo "Acquire::ftp::Proxy 'ftp://{}';" >> /etc/apt/apt.conf.d/99proxy
+export http_proxy='http://{}'
+export https_proxy='https://{}'
+export ftp_proxy='ftp://{}'
+'''
+
+APTCACHER = '''# local caching proxy for apt only, pip and others go direct
+echo 'Acquire::http::Proxy "http://{}";' | tee /etc/apt/apt.conf.d/98cacher
+'''
+
+APTSHARED = '/var/cache/vagrant-ninja/apt'
+
+APTCACHE = '''# host .deb cache shared by the VMs of same codename and arch,
+# new .deb files are published with an atomic rename under a mkdir lock
+APTSHARED={}
+apt_cache_in() {{  # copy in only the .deb files apt-get $@ would download
+    apt-get -qq -y --print-uris "$@" | tr -d "'" | while read url name rest
+    do
+        [ -e "$APTSHARED/$name" ] &&
+        cp "$APTSHARED/$name" /var/cache/apt/archives/
+    done
+    return 0  # the shared cache only saves downloads
+}}
+apt_cache_out() {{
+    find $APTSHARED/.lock -maxdepth 0 -mmin +30 -exec rmdir {{}} \\; \\
+        2>/dev/null
+    until mkdir $APTSHARED/.lock 2>/dev/null ; do sleep 1 ; done
+    for deb in /var/cache/apt/archives/*.deb ; do
+        [ -e "$deb" ] && [ ! -e "$APTSHARED/${{deb##*/}}" ] &&
+        cp "$deb" "$APTSHARED/.${{deb##*/}}.$$" &&
+        mv "$APTSHARED/.${{deb##*/}}.$$" "$APTSHARED/${{deb##*/}}"
+    done
+    rmdir $APTSHARED/.lock
+}}
+'''
+
+WHEELSHARED = '/var/cache/vagrant-ninja/wheels'
+
+WHEELHOUSE = '''# offline pip install of wheels shared by VMs of same codename,
+# arch, requirements, missing ones are built once and published atomically
+WHEELS={}
+wheelhouse_install() {{
+    pip install --no-index --find-links $WHEELS "$@" 2> /dev/null && return
+    pip install --upgrade pip wheel > /dev/null 2>&1 ; hash -r
+    rm -rf /tmp/wheels ; mkdir -p /tmp/wheels
+    if pip wheel --find-links $WHEELS --wheel-dir /tmp/wheels "$@" ; then
+        for whl in /tmp/wheels/*.whl ; do
+            [ -e "$whl" ] && [ ! -e "$WHEELS/${{whl##*/}}" ] &&
+            cp "$whl" "$WHEELS/.${{whl##*/}}.$$" &&
+            mv "$WHEELS/.${{whl##*/}}.$$" "$WHEELS/${{whl##*/}}"
+        done
+        pip install --no-index --find-links $WHEELS "$@"
+    else
+        pip install --verbose "$@"
+    fi
+}}
+'''
+
+STEPS = '''# a step is skipped while the hash of its inputs matches its stamp,
+# remove /var/lib/vagrant-ninja to run all the steps again
+STAMPS=/var/lib/vagrant-ninja
+PREFETCH=/var/cache/vagrant-ninja/prefetch
+RUN=$(mktemp -d)
+mkdir -p $STAMPS $PREFETCH
+export LANGUAGE=en_US.UTF-8 LANG=en_US.UTF-8 LC_ALL=en_US.UTF-8
+step() {
+    if [ "$(cat $STAMPS/$1 2>/dev/null)" = "$2" ] ; then
+        echo "vagrant-ninja: step $1 is up to date, skipping"
+        return 0
+    fi
+    echo "vagrant-ninja: step $1 running"
+    if step_$1 ; then
+        echo "$2" > $STAMPS/$1
+    else
+        echo "vagrant-ninja: step $1 FAILED" >&2
+        return 1
+    fi
+}
+run() {  # run step $1 with hash $2 after the steps $3... have succeeded,
+         # or just after they have finished for @step
+    local name=$1 hash=$2 begin dep ; shift 2
+    for need in "$@" ; do
+        dep=${need#@}
+        until [ -e $RUN/$dep.ok ] || [ -e $RUN/$dep.fail ] ; do sleep 1 ; done
+        if [ -e $RUN/$dep.fail ] && [ "$dep" = "$need" ] ; then
+            echo "vagrant-ninja: step $name failed in 0s, needs $dep" >&2
+            touch $RUN/$name.fail
+            return 1
+        fi
+    done
+    begin=$(date +%s)
+    if step $name $hash 2>&1 | sed -u "s/^/[$name] /" ;
+        [ ${PIPESTATUS[0]} = 0 ]
+    then
+        touch $RUN/$name.ok
+        echo "vagrant-ninja: step $name done in $(( $(date +%s) - begin ))s"
+    else
+        touch $RUN/$name.fail
+        echo "vagrant-ninja: step $name failed in $(( $(date +%s) - begin ))s"
+    fi
+}
+prefetch() {  # download .deb files in parallel, without taking apt locks,
+              # but not the ones the shared cache already has
+    apt-get -qq -y --print-uris install "$@" | tr -d "'" |
+    while read url name rest ; do
+        [ -e /var/cache/apt/archives/$name ] || [ -e $PREFETCH/$name ] ||
+        [ -e "${APTSHARED:-/nonexistent}/$name" ] ||
+        echo "$url $PREFETCH/$name"
+    done | xargs -r -n 2 -P 4 sh -c 'wget -q -O "$1.$$.part" "$0" &&
+                                     mv "$1.$$.part" "$1"'
+    return 0  # apt-get downloads whatever could not be prefetched
+}
+prefetch_in() {
+    mv $PREFETCH/*.deb /var/cache/apt/archives/ 2>/dev/null || true
+}
+'''
+
+CONFIG = '''
+Vagrant.configure("2") do |config|
+    config.vm.box = "{}"
+    config.vm.hostname = "{}"
+    config.vm.box_url = "{}"
+    config.vm.provision :shell, :path => "bootstrap.sh"
+
+{}
+    {}
+end
+'''
+
+FORWARD = ('    config.vm.network :forwarded_port, host: {}, guest: {},'
+           ' auto_correct: true')  # VMs of a fleet can not share host ports
+
+SYNCED = '    config.vm.synced_folder "{}", "{}"'
+
+SYNCMODES = {'virtualbox': SYNCED,
+    'nfs': SYNCED + ', type: "nfs"',  # needs a private network and nfsd
+    'rsync': SYNCED + ', type: "rsync", rsync__exclude: [".vagrant/"]'}
+
+PRIVATE = '    config.vm.network :private_network, type: "dhcp"'
+
+PROJECT = '/project'  # where the current Ninja project shows up on the VM
+
+IOBENCH = '''#!/usr/bin/env bash
+# small file I/O benchmark, run inside the VM to compare synced folder modes
+# usage: bash /vagrant/iobench.sh [files] [folders...], folders default to
+# /vagrant {} and the VM own disk /tmp, only existing folders are tested
+FILES=${{1:-2000}}
+shift
+[ $# -eq 0 ] && set -- /vagrant {} /tmp
+ms() {{ echo $(( $(date +%s%N) / 1000000 )); }}
+for DIR in "$@"; do
+    [ -d "$DIR" ] || continue
+    T=$(mktemp -d "$DIR/.iobench.XXXX") || continue
+    B=$(ms); for i in $(seq "$FILES"); do echo "$i" > "$T/f$i"; done
+    CREATE=$(( $(ms) - B )); B=$(ms)
+    ls -lR "$T" > /dev/null
+    STAT=$(( $(ms) - B )); B=$(ms)
+    cat "$T"/f* > /dev/null
+    READ=$(( $(ms) - B )); B=$(ms)
+    dd if=/dev/zero of="$T/big" bs=1M count=64 conv=fsync 2> /dev/null
+    WRITE=$(( $(ms) - B )); B=$(ms)
+    rm -rf "$T"
+    DELETE=$(( $(ms) - B ))
+    echo "vagrant-ninja: iobench $DIR $FILES files: create $CREATE ms," \\
+        "stat $STAT ms, read $READ ms, delete $DELETE ms, 64MB $WRITE ms"
+done
+'''.format(PROJECT, PROJECT)
+
+BASE = path.abspath(path.join(path.expanduser("~"), 'vagrant'))
+
+DEFAULTS = {'name': getuser(), 'codename': 'saucy', 'arch': 'amd64',
+    'protocol': 'https', 'ports': '8000, 9000', 'gui': True, 'ram': 1024,
+    'cpu': 99, 'cpus': 1, 'aptproxy': '', 'ppa': '', 'update': True,
+    'upgrade': True, 'aptpkg': 'build-essential git python-pip vim mc wget',
+    'pippkg': 'virtualenv yolk', 'requirements': '', 'desktop': '',
+    'boxcache': True, 'aptcache': True, 'aptcacher': '', 'wheelhouse': True,
+    'golden': False, 'syncmode': 'virtualbox', 'project': ''}
+
+BOXES = path.join(BASE, 'boxes')
+
+BOXURL = '{}://cloud-images.ubuntu.com/vagrant/{}/current/'
+
+BOXFILE = '{}-server-cloudimg-{}-vagrant-disk1.box'
+
+STATUSKEYS = {'provider-name': 'provider', 'state': 'state',
+              'machine-home': 'home'}
+
+PHASES = (('provision', 'Running provisioner'), ('mount', 'shared folder'),
+    ('mount', 'Mounting'), ('network', 'network'), ('network', 'Forwarding'),
+    ('boot', 'Booting'), ('boot', 'boot'), ('box', 'box'),
+    ('box', 'Downloading'), ('box', 'Importing'))
+
+STEPRE = regex(r'vagrant-ninja: step (\w+) (done|failed) in (\d+) ?s')
+
+PROGRESSRE = regex(r'Progress: (\d+)%')
+
+PORTRE = regex(r'(\d+) (?:\(guest\) )?=> (\d+)(?: \(host\))? \(adapter|'
+               r'collision for (\d+) => \d+\. Now on port (\d+)')
+
+HOSTRESERVE = 1024  # MB of RAM always left free for the host
+
+ADMITHOLD = 30  # seconds a build is held before asking for resources again
+
+ADMITTTL = 300  # seconds until the RAM of a booting VM shows up as used
+
+APTCACHEDIR = path.join(BASE, 'apt-cache')
+
+WHEELDIR = path.join(BASE, 'wheelhouse')
+
+GOLDEN = path.join(BASE, 'golden')
+
+FINGERPRINT = '.vagrant_ninja.json'  # config hashes, next to the Vagrantfile
+
+POOL = path.join(BASE, 'pool')
+
+POOLFILE = '.vagrant_ninja_pool.json'  # name and state of a warm pool VM
+
+REHOST = ('sudo hostname {0} && echo {0} | sudo tee /etc/hostname > /dev/null'
+          ' && sudo sed -i s/{1}/{0}/g /etc/hosts')
+
+ACTIONS = {'create': ('up', 'New VM, creating it from its box'),
+    'rebuild': ('up', 'Box changed, destroying and creating the VM again'),
+    'reload': ('reload --provision', 'Config changed, reloading the VM'),
+    'provision': ('up --provision', 'Bootstrap changed, provisioning again'),
+    'resume': ('up', 'Nothing changed, resuming or booting the VM')}
+
+HISTORY = path.join(BASE, '.vagrant_ninja_history.jsonl')
+
+REGRESSION = 1.5  # a phase this many times slower than its median regressed
+
+SLACK = 30  # seconds a phase may drift before it counts as a regression
+
+
+###############################################################################
+
+
+def box_url(opts):
+    ' return the cached file:// box for opts if any, else the remote box URL '
+    cached = cached_box(opts) if opts['boxcache'] is True else ''
+    return 'file://' + cached if cached else (BOXURL.format(opts['protocol'],
+        opts['codename']) + BOXFILE.format(opts['codename'], opts['arch']))
+
+
+def box_name(opts):
+    ' return the box name shared by the VMs of codename, arch and box sum '
+    cached = cached_box(opts) if opts['boxcache'] is True else ''
+    return 'vagrant-ninja-{}-{}{}'.format(opts['codename'], opts['arch'],
+        '-' + path.splitext(cached)[0].rsplit('-', 1)[-1][:16] if cached
+        else '')
+
+
+def golden_name(opts):
+    ' return the golden box name for codename, arch and provisioning steps '
+    return 'vagrant-ninja-{}-{}-{}'.format(opts['codename'], opts['arch'],
+        step_hash([step_hash(lines, inputs) for name, deps, inputs, lines
+                   in bootstrap_steps(opts)]))
+
+
+def golden_box(opts):
+    ' return the packaged golden box for opts, if it was already built '
+    box = path.join(GOLDEN, golden_name(opts), 'golden.box')
+    return box if path.isfile(box) else ''
+
+
+def apt_cache_dir(opts):
+    ' return the host folder of the shared .deb cache for codename and arch '
+    return path.join(APTCACHEDIR, '{}-{}'.format(opts['codename'],
+                                                 opts['arch']))
+
+
+def read_requirements(opts):
+    ' return the contents of the requirements file of opts, if readable '
+    try:
+        with open(opts['requirements']) as f:
+            return f.read()
+    except IOError:
+        return ''
+
+
+def wheel_requirements(opts):
+    ' return every pip requirement of opts, one requirement per item '
+    return str(opts['pippkg']).split() + [a.split('#')[0].strip() for a in
+        read_requirements(opts).splitlines() if a.split('#')[0].strip() and
+        not a.strip().startswith('-')] if opts['requirements'] else str(
+        opts['pippkg']).split()
+
+
+def wheelhouse_dir(opts):
+    ' return the wheelhouse shared by VMs of codename, arch, requirements '
+    return path.join(WHEELDIR, '{}-{}'.format(opts['codename'], opts['arch']),
+                     step_hash(wheel_requirements(opts)))
+
+
+def render_config(opts):
+    ' return the Vagrantfile for a dict of VM options '
+    lines = [FORWARD.format(a, a) for a in [
+        b.strip() for b in str(opts['ports']).split(',')] if a]
+    if opts['syncmode'] == 'nfs':
+        lines.append(PRIVATE)
+    if opts['syncmode'] != 'virtualbox':
+        lines.append(SYNCMODES[opts['syncmode']].format('.', '/vagrant'))
+    if opts['project']:
+        lines.append(SYNCMODES[opts['syncmode']].format(opts['project'],
+                                                       PROJECT))
+    if opts['aptcache'] is True:
+        lines.append(SYNCED.format(apt_cache_dir(opts), APTSHARED))
+    if opts['wheelhouse'] is True:  # same folder whatever the requirements
+        lines.append(SYNCED.format(path.dirname(wheelhouse_dir(opts)),
+                                   WHEELSHARED))
+    golden = golden_box(opts) if opts['golden'] is True else ''
+    return CONFIG.format(golden_name(opts) if golden else box_name(opts),
+        opts['name'], 'file://' + golden if golden else box_url(opts),
+        '\n'.join(lines), VBOXGUI.format('true' if opts['gui'] is True
+            else 'false', opts['ram'], opts['cpu'], opts['cpus'],
+            LINKED if golden else ''))
+
+
+def bootstrap_steps(opts):
+    ' return the provisioning DAG as (name, dependencies, inputs, lines) '
+    # @step only orders after step, apt and debconf locks forbid overlaps
+    upgrade, steps = opts['upgrade'] is True, []
+    cache_out = ['apt_cache_out'] if opts['aptcache'] is True else []
+
+    def cache_in(args):
+        ' copy the shared .deb files apt-get args needs into the VM '
+        return ['apt_cache_in ' + args] if cache_out else []
+    ppa, requirements = str(opts['ppa']).strip(), read_requirements(opts)
+    wheels = opts['wheelhouse'] is True and wheel_requirements(opts)
+    pip = 'wheelhouse_install' if wheels else 'pip install --verbose'
+    aptpkg = ' '.join(str(opts['aptpkg']).split())
+    for name, deps, inputs, lines in (
+        ('ppa', (), '', ['add-apt-repository -s -y {}'.format(ppa)]
+            if ppa else []),
+        ('locale', (), '', ['locale-gen en_US.UTF-8',
+                            'dpkg-reconfigure locales']),
+        ('system', (), '', [
+            '(ufw status ; service ufw stop ; ufw disable) || true',
+            'swapoff --verbose --all']),
+        ('update', ('ppa', ), ppa, ['apt-get -V -u -m -y update']
+            if opts['update'] is True else []),
+        ('fetch', ('update', ), '', ['prefetch ' + aptpkg] if aptpkg else []),
+        ('fetchdesktop', ('update', ), '', ['prefetch ' + opts['desktop']]
+            if opts['desktop'] else []),
+        ('upgrade', ('update', '@locale'), '', cache_in('dist-upgrade') + [
+            'apt-get -y -m dist-upgrade', 'apt-get -y -m autoremove'] +
+            cache_out + ['dpkg --configure -a', 'apt-get -y -f install',
+            'apt-get -y check'] if upgrade else []),
+        ('packages', ('upgrade', '@fetch', '@locale'), '', ['prefetch_in'] +
+            cache_in('install ' + aptpkg) + ['apt-get -y --force-yes install '
+            + aptpkg] + cache_out if aptpkg else []),
+        ('git', ('@packages', ), '', [
+            'git config --global user.name "{}"'.format(getuser()),
+            'git config --global color.branch auto',
+            'git config --global color.diff auto',
+            'git config --global color.interactive auto',
+            'git config --global color.status auto',
+            'git config --global credential.helper cache',
+            'git config --global user.email "{}@gmail.com"'.format(getuser()),
+            'git config --global push.default simple']),
+        ('pip', ('packages', ), '', [pip + ' '
+            + ' '.join(str(opts['pippkg']).split())]
+            if str(opts['pippkg']).strip() else []),
+        ('requirements', ('packages', 'pip'), requirements, ['{} -r {}'.format(
+            pip, '$WHEELS/requirements.txt' if wheels
+            else opts['requirements'])] if opts['requirements'] else []),
+        ('desktop', ('packages', '@fetchdesktop', '@locale'), '', [
+            'prefetch_in'] + cache_in('install ' + opts['desktop']) + [
+            'apt-get -y --force-yes -m install ' + opts['desktop']] +
+            cache_out if opts['desktop'] else []),
+        ('clean', ('@upgrade', '@packages', '@desktop'), '', [
+            'apt-get -y clean'] if upgrade else [])):
+        if lines:  # a missing dependency waits on the last apt step instead
+            names, wait = [a[0] for a in steps], []
+            apt = [a for a in names if a in ('ppa', 'update', 'upgrade',
+                                             'packages', 'desktop')]
+            for dep in deps:
+                if dep.lstrip('@') not in names:
+                    dep = ('@' if dep.startswith('@') else '') + ''.join(
+                        apt[-1:]) if apt else ''
+                if dep and dep not in wait:
+                    wait.append(dep)
+            steps.append((name, tuple(wait), inputs, lines))
+    return steps
+
+
+def step_hash(lines, inputs=''):
+    ' return the hash of the commands and inputs of a provisioning step '
+    return sha256('\n'.join(list(lines) + [inputs]).encode('utf-8')
+                  ).hexdigest()[:16]
+
+
+def render_bootstrap(opts):
+    ' return the bootstrap.sh provisioning script for a dict of VM options '
+    proxy = APTGET_PROXY.format(*[opts['aptproxy']] * 6)
+    steps = bootstrap_steps(opts)
+    return '\n'.join(['#!/usr/bin/env bash', '# -*- coding: utf-8 -*-',
+        r"PS1='\[\e[1;32m\][\u@\h \W]\$\[\e[0m\] ' ; HISTSIZE=5000",
+        '# Vagrant Bootstrap Provisioning generated by Vagrant Ninja!',
+        proxy if len(opts['aptproxy']) >= 5 else '',
+        APTCACHER.format(opts['aptcacher']) if opts['aptcacher'] else '',
+        APTCACHE.format(APTSHARED) if opts['aptcache'] is True else '',
+        WHEELHOUSE.format(WHEELSHARED + '/' + path.basename(wheelhouse_dir(
+            opts))) if opts['wheelhouse'] is True and wheel_requirements(opts)
+        else '',
+        STEPS] + ['step_{}() {{\n    {}\n}}\n'.format(name,
+        ' &&\n    '.join(lines)) for name, deps, inputs, lines in steps] + [
+        '# every step starts as soon as the steps it needs have succeeded'] + [
+        ' '.join(('run', name, step_hash(lines, inputs)) + deps + ('&', ))
+        for name, deps, inputs, lines in steps] + ['wait',
+        'echo "vagrant-ninja: provisioning done in $SECONDS s"',
+        '! ls $RUN/*.fail > /dev/null 2>&1', ''])
+
+
+def write_vm(opts, base=None):
+    ' write Vagrantfile and bootstrap.sh for opts into its target, return it '
+    base = base or path.join(BASE, opts['name'])
+    for folder in (base, apt_cache_dir(opts) if opts['aptcache'] is True
+                   else base, wheelhouse_dir(opts) if opts['wheelhouse'] is
+                   True else base):
+        if not path.isdir(folder):
+            makedirs(folder)
+    with open(path.join(base, 'Vagrantfile'), 'w') as f:
+        f.write(render_config(opts))
+    with open(path.join(base, 'bootstrap.sh'), 'w') as f:
+        f.write(render_bootstrap(opts))
+    with open(path.join(base, 'iobench.sh'), 'w') as f:
+        f.write(IOBENCH)
+    if opts['wheelhouse'] is True and wheel_requirements(opts):
+        wheels = path.join(wheelhouse_dir(opts), 'requirements.txt')
+        with open(wheels + '.tmp', 'w') as f:  # other VMs may be reading it
+            f.write(read_requirements(opts) if opts['requirements'] else '')
+        rename(wheels + '.tmp', wheels)
+    chmod(path.join(base, 'bootstrap.sh'), 0o775)
+    return base
+
+
+def synced_by_rsync(folder):
+    ' return True if the Vagrantfile in folder syncs with rsync '
+    try:
+        with open(path.join(folder, 'Vagrantfile')) as f:
+            return 'type: "rsync"' in f.read()
+    except IOError:
+        return False
+
+
+def vm_fingerprint(opts):
+    ' return the hashes of the box, Vagrantfile and bootstrap.sh of opts '
+    stable = dict(opts, boxcache=False, golden=False)  # box is import only
+    return dict((a, sha256(b.encode('utf-8')).hexdigest()) for a, b in (
+        ('boxid', ' '.join((opts['codename'], opts['arch']))),  # not its URL
+        ('config', render_config(stable)),
+        ('bootstrap', render_bootstrap(stable))))
+
+
+def vm_action(opts, base=None):
+    ' return the ACTIONS key that brings the VM of opts up to date '
+    base = base or path.join(BASE, opts['name'])
+    if not glob(path.join(base, '.vagrant', 'machines', '*', '*', 'id')):
+        return 'create'
+    done, todo = load_json(path.join(base, FINGERPRINT), {}), vm_fingerprint(
+        opts)
+    if done.get('boxid', todo['boxid']) != todo['boxid']:
+        return 'rebuild'  # reload would keep the disk of the old box
+    if done.get('config') != todo['config']:
+        return 'reload'
+    return 'provision' if done.get('bootstrap') != todo['bootstrap'] else (
+        'resume')
+
+
+def pool_profile(opts):
+    ' return the warm pool of opts, VMs that differ only on their name '
+    return '{}-{}-{}'.format(opts['codename'], opts['arch'], step_hash(
+        sorted(vm_fingerprint(dict(opts, name='pool')).values())))
+
+
+def pool_vms(opts, states=('ready', )):
+    ' return the folders of the warm pool VMs of opts that are in states '
+    return sorted(path.dirname(a) for a in glob(path.join(POOL, pool_profile(
+        opts), '*', POOLFILE)) if load_json(a, {}).get('state') in states)
+
+
+def pool_new(opts):
+    ' render a new VM for the warm pool of opts, return its folder '
+    name = 'pool-' + uuid4().hex[:8]
+    folder = write_vm(dict(opts, name=name), path.join(POOL, pool_profile(
+        opts), name))
+    save_json(path.join(folder, POOLFILE), {'name': name, 'state': 'filling'})
+    return folder
+
+
+def pool_mark(folder, **state):
+    ' update the name and state of the warm pool VM in folder '
+    save_json(path.join(folder, POOLFILE), dict(load_json(path.join(
+        folder, POOLFILE), {}), **state))
+
+
+def pool_claim(opts, base=None):
+    ' hand a ready warm pool VM out as the VM of opts, return its old name '
+    base = base or path.join(BASE, opts['name'])
+    if path.isdir(base) and not path.islink(base) and not listdir(base):
+        rmdir(base)
+    for folder in pool_vms(opts)[:1] if not path.lexists(base) else []:
+        symlink(folder, base)
+        pool_mark(folder, state='claimed', owner=opts['name'])
+        write_vm(opts, base)
+        save_json(path.join(base, FINGERPRINT), vm_fingerprint(opts))
+        return load_json(path.join(folder, POOLFILE), {})['name']
+    return ''
+
+
+def load_json(filename, default):
+    ' return the decoded JSON file, or default if it can not be read '
+    try:
+        with open(filename) as f:
+            return load(f)
+    except Exception:
+        return default
+
+
+def save_json(filename, data):
+    ' atomically write data as JSON to filename, creating its folder '
+    if not path.isdir(path.dirname(filename)):
+        makedirs(path.dirname(filename))
+    with open(filename + '.tmp', 'w') as f:
+        dump(data, f, indent=1, sort_keys=True)
+    rename(filename + '.tmp', filename)
+
+
+def which(binary):
+    ' return the full path of binary on the PATH, or an empty string '
+    for folder in environ.get('PATH', '').split(pathsep):
+        candidate = path.join(folder, binary)
+        if path.isfile(candidate) and access(candidate, X_OK):
+            return path.realpath(candidate)
+    return ''
+
+
+def backend_key(binaries):
+    ' return a cache key made of the path and mtime of every binary '
+    return '|'.join('{}:{}'.format(which(a), path.getmtime(which(a))
+                    if which(a) else 0) for a in binaries)
+
+
+def cached_box(opts):
+    ' return the path of the cached box for codename and arch, if any '
+    key = '{}-{}'.format(opts['codename'], opts['arch'])
+    try:
+        with open(path.join(BOXES, key + '.sha256')) as f:
+            box = path.join(BOXES, '{}-{}.box'.format(key, f.read().strip()))
+    except IOError:
+        return ''
+    return box if path.isfile(box) else ''
+
+
+def fetch_box(url, dest, checksum=None, progress=None, chunk=1024 * 1024):
+    ' resumable download of url to dest, verify its SHA256, return the sum '
+    part, digest = dest + '.part', sha256()
+    offset = path.getsize(part) if path.isfile(part) else 0
+    if offset:
+        with open(part, 'rb') as f:
+            for data in iter(lambda: f.read(chunk), b''):
+                digest.update(data)
+    try:
+        response = urlopen(Request(url, headers={'Range': 'bytes={}-'.format(
+                                                                   offset)}))
+    except HTTPError as error:
+        if error.code != 416 or not offset:
+            raise
+        size = str(error.info().get('Content-Range') or '').split('/')[-1]
+        if size.isdigit() and int(size) != offset:
+            remove(part)  # longer than the file, start again on next retry
+            raise IOError('Partial download larger than {}'.format(url))
+        response = None  # the .part is already whole, verify it below
+    if response is not None:
+        skip = offset if offset and response.getcode() != 206 else 0
+        total = offset + int(response.info().get('Content-Length') or 0
+                             ) - skip
+        with open(part, 'ab') as f:
+            for data in iter(lambda: response.read(chunk), b''):
+                if skip:  # server ignored the Range, drop what we have
+                    data, skip = data[skip:], max(0, skip - len(data))
+                f.write(data)
+                digest.update(data)
+                offset += len(data)
+                if progress is not None:
+                    progress(offset, total)
+        response.close()
+    if checksum is not None and digest.hexdigest() != checksum:
+        remove(part)
+        raise IOError('Checksum mismatch for {}'.format(url))
+    rename(part, dest)
+    return digest.hexdigest()
+
+
+def cache_box(opts, progress=None, url=None, sums=None):
+    ' download the box for opts into the local box cache, return its path '
+    if cached_box(opts):
+        return cached_box(opts)
+    filename = BOXFILE.format(opts['codename'], opts['arch'])
+    url = url or BOXURL.format(opts['protocol'], opts['codename']) + filename
+    checksum, key = None, '{}-{}'.format(opts['codename'], opts['arch'])
+    try:
+        response = urlopen(sums or url.rsplit('/', 1)[0] + '/SHA256SUMS')
+        for line in response.read().decode('utf-8').splitlines():
+            if line.split() and line.split()[-1].lstrip('*') == filename:
+                checksum = line.split()[0]
+        response.close()
+    except Exception:
+        pass  # no published sums, the box is keyed by its own checksum
+    if not path.isdir(BOXES):
+        makedirs(BOXES)
+    temp = path.join(BOXES, '{}-{}.box'.format(key, checksum or 'download'))
+    checksum = fetch_box(url, temp, checksum, progress)
+    box = path.join(BOXES, '{}-{}.box'.format(key, checksum))
+    rename(temp, box)
+    for old in glob(path.join(BOXES, key + '-*.box')):
+        if old != box:
+            remove(old)
+    with open(path.join(BOXES, key + '.sha256'), 'w') as f:
+        f.write(checksum)
+    return box
+
+
+def parse_global_status(text):
+    ' parse vagrant global-status --machine-readable into home: machine '
+    machines, machine = {}, None
+    for line in as_text(text).splitlines():
+        fields = line.split(',')
+        if len(fields) < 4:
+            continue
+        key = fields[2]
+        value = ','.join(fields[3:]).replace('%!(VAGRANT_COMMA)', ',').strip()
+        if key == 'machine-id':
+            machine = {'id': value, 'state': 'unknown', 'provider': '',
+                       'home': ''}
+        elif machine is not None and key in STATUSKEYS:
+            machine[STATUSKEYS[key]] = value
+            if key == 'machine-home':
+                machines[path.realpath(value)] = machine
+    return machines
+
+
+def vm_folders(base=BASE):
+    ' return every folder under base holding a Vagrantfile '
+    return sorted(path.dirname(a) for a in glob(path.join(base, '*',
+                                                          'Vagrantfile')))
+
+
+def parse_runningvms(text, folders):
+    ' map vboxmanage list runningvms onto the machines of the folders '
+    running, machines = as_text(text), {}
+    for folder in folders:
+        for id_file in glob(path.join(folder, '.vagrant', 'machines', '*',
+                                      'virtualbox', 'id')):
+            with open(id_file) as f:
+                uuid = f.read().strip()
+            machines[path.realpath(folder)] = {'id': uuid, 'home': folder,
+                'provider': 'virtualbox', 'state': 'running'
+                if '{' + uuid + '}' in running else 'not running'}
+    return machines
+
+
+def host_resources(proc='/proc'):
+    ' return free RAM in MB, cores and 1 minute load of the host from /proc '
+    meminfo = {}
+    with open(path.join(proc, 'meminfo')) as f:
+        for line in f:
+            fields = line.replace(':', ' ').split()
+            meminfo[fields[0]] = int(fields[1]) // 1024
+    with open(path.join(proc, 'loadavg')) as f:
+        load = float(f.read().split()[0])
+    return {'free': meminfo.get('MemAvailable', meminfo['MemFree'] +
+            meminfo.get('Buffers', 0) + meminfo.get('Cached', 0)),
+            'total': meminfo['MemTotal'], 'cores': cpu_count(), 'load': load}
+
+
+def process_age(proc='/proc'):
+    ' return the seconds this process has been running, 0 if no /proc '
+    try:
+        with open(path.join(proc, 'self', 'stat')) as f:
+            ticks = int(f.read().rsplit(')', 1)[1].split()[19])  # starttime
+        with open(path.join(proc, 'uptime')) as f:
+            return float(f.read().split()[0]) - ticks / float(sysconf(
+                'SC_CLK_TCK'))
+    except (IOError, OSError):
+        return 0.0
+
+
+class Admission(object):
+    " Hold VM builds that would overcommit the host, size the others "
+    def __init__(self, resources=host_resources, reserve=HOSTRESERVE,
+                 ttl=ADMITTTL):
+        " Init Admission Class "
+        self.resources, self.reserve, self.ttl = resources, reserve, ttl
+        self.booking = {}
+
+    def request(self, opts):
+        ' return (True, sized opts) if opts fits the host, else (False, why) '
+        host, now = self.resources(), time()
+        self.booking = dict((a, b) for a, b in self.booking.items()
+                            if now - b[2] < self.ttl)
+        booked_ram = sum(a[0] for a in self.booking.values())
+        booked_cpus = sum(a[1] for a in self.booking.values())
+        free = host['free'] - self.reserve - booked_ram
+        idle = host['cores'] - host['load'] - booked_cpus
+        if free < 512:
+            return False, 'only {} MB of RAM free, {} MB booked'.format(
+                max(free, 0), booked_ram)
+        if idle < 0.5:
+            return False, 'load {} on {} cores, {} cores booked'.format(
+                host['load'], host['cores'], booked_cpus)
+        cpus = max(1, min(int(opts['cpus']), int(idle)))
+        sized = dict(opts, ram=min(int(opts['ram']), free // 128 * 128),
+            cpus=cpus, cpu=max(25, min(int(opts['cpu']), int(100 * idle /
+                                                            cpus))))
+        self.booking[opts['name']] = (sized['ram'], cpus, now)
+        return True, sized
+
+    def release(self, name):
+        ' forget the booking of a VM that failed or has finished booting '
+        self.booking.pop(name, None)
+
+
+def parse_fleet(text, defaults):
+    ' parse one VM spec per line into a list of options dicts '
+    specs = []
+    for line in str(text).splitlines():
+        fields = line.split('#')[0].split()
+        if not fields:
+            continue
+        opts = dict(defaults)
+        for key, value in zip(('name', 'codename', 'arch', 'ram', 'cpu'),
+                              fields):
+            if key in ('ram', 'cpu') and not value.isdigit():
+                raise ValueError('{} of {} is {}, not a number'.format(
+                    key, fields[0], value))
+            opts[key] = int(value) if key in ('ram', 'cpu') else value
+        if len(fields) > 5:
+            opts['aptpkg'] = ' '.join(fields[5:])
+        specs.append(opts)
+    return specs
+
+
+def as_text(data):
+    ' return process output, bytes or a QByteArray, as unicode text '
+    return data if isinstance(data, type(u'')) else bytes(data).decode(
+        'utf-8', 'replace')
+
+
+def echo(text):
+    ' print a line of text, UTF-8 encoded where Python 2 print would fail '
+    print(text if isinstance(text, str) else text.encode('utf-8'))
+
+
+class ProgressParser(object):
+    " Turn chunks of vagrant --machine-readable output into typed events "
+    def __init__(self):
+        " Init ProgressParser Class "
+        self.buffer, self.phase = '', ''
+        self.decoder = getincrementaldecoder('utf-8')('replace')
+
+    def feed(self, chunk):
+        ' parse a chunk, return (kind, text, value) events of its records '
+        if not isinstance(chunk, type(u'')):  # may end mid character
+            chunk = self.decoder.decode(bytes(chunk))
+        lines = (self.buffer + chunk).split('\n')
+        self.buffer, events = lines.pop(), []
+        for line in lines:
+            events.extend(self.parse(line.rstrip('\r')))
+        return events
+
+    def close(self):
+        ' parse whatever is left of an incomplete last record '
+        self.buffer += self.decoder.decode(b'', True)
+        events, self.buffer = self.parse(self.buffer), ''
+        return events
+
+    def parse(self, line):
+        ' return the events of one complete line '
+        fields = line.split(',', 4)
+        if len(fields) < 4 or not fields[0].isdigit():
+            return [self.event(line)] if line.strip() else []
+        kind, data = fields[2], [a.replace('%!(VAGRANT_COMMA)', ',').replace(
+            '\\n', '\n').replace('\\r', '') for a in fields[3:]]
+        if kind == 'error-exit':
+            return [('error', data[-1], data[0])]
+        if kind != 'ui':
+            return []
+        return [self.event(a, data[0] == 'error') for a in
+                data[-1].splitlines() if a.strip()]
+
+    def event(self, text, error=False):
+        ' classify one line of human readable output '
+        step, progress = STEPRE.search(text), PROGRESSRE.search(text)
+        port = PORTRE.search(text)
+        if error:
+            return ('error', text, None)
+        if step:
+            return ('step', text, (step.group(1), step.group(2),
+                                   int(step.group(3))))
+        if progress:
+            return ('download', text, int(progress.group(1)))
+        if port:  # guest port and the host port vagrant picked for it
+            return ('port', text, tuple(int(a) for a in port.groups() if a))
+        if text.lstrip().startswith('==>'):
+            for phase, mark in PHASES:
+                if mark in text and phase != self.phase:
+                    self.phase = phase
+                    return ('phase', text, phase)
+                elif mark in text:
+                    break
+        return ('output', text, self.phase)
+
+
+class RunTimer(object):
+    " Time the phases and provisioning steps of one run from its events "
+    def __init__(self, opts, clock=time):
+        " Init RunTimer Class "
+        self.opts, self.clock, self.begin = opts, clock, clock()
+        self.phase, self.since, self.phases = 'prepare', self.begin, {}
+        self.steps, self.failed = {}, []
+
+    def lap(self, phase):
+        ' charge the time since the last lap to the current phase, go on '
+        now = self.clock()
+        self.phases[self.phase] = self.phases.get(self.phase, 0) + (
+            now - self.since)
+        self.phase, self.since = phase, now
+
+    def event(self, kind, text, value):
+        ' account one (kind, text, value) event of a ProgressParser '
+        if kind == 'phase':
+            self.lap(value)
+        elif kind == 'step':
+            self.steps[value[0]] = value[2]  # as measured inside the guest
+            if value[1] == 'failed':
+                self.failed.append(value[0])
+
+    def record(self, code=0):
+        ' return the history entry of the run, ended with exit status code '
+        self.lap('')
+        return {'name': self.opts['name'], 'codename': self.opts['codename'],
+            'arch': self.opts['arch'], 'date': str(datetime.now()),
+            'exit': code, 'total': round(self.clock() - self.begin, 1),
+            'phases': dict((a, round(b, 1)) for a, b in self.phases.items()),
+            'steps': self.steps, 'failed': self.failed}
+
+
+def save_history(entry, filename=HISTORY):
+    ' append one run to the JSON lines history file, creating its folder '
+    if not path.isdir(path.dirname(filename)):
+        makedirs(path.dirname(filename))
+    with open(filename, 'a') as f:
+        f.write(dumps(entry, sort_keys=True) + '\n')
+
+
+def load_history(filename=HISTORY):
+    ' return every run of the history file, skipping the unreadable ones '
+    runs = []
+    try:
+        with open(filename) as f:
+            for line in f:
+                try:
+                    runs.append(loads(line))
+                except ValueError:
+                    pass
+    except IOError:
+        pass
+    return runs
+
+
+def duration(seconds):
+    ' return seconds as a short human readable 1h2m, 3m or 45s string '
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return '{}h{}m'.format(seconds // 3600, seconds % 3600 // 60)
+    return '{}m'.format(seconds // 60) if seconds >= 60 else '{}s'.format(
+        seconds)
+
+
+def median(values):
+    ' return the median of a non empty list of numbers '
+    values = sorted(values)
+    half = len(values) // 2
+    return values[half] if len(values) % 2 else (values[half - 1] +
+                                                 values[half]) / 2.0
+
+
+def regression_report(runs, factor=REGRESSION, slack=SLACK, window=10):
+    ' compare the last good run of each codename/arch with the ones before '
+    profiles, report = {}, []
+    for run in runs:
+        if run.get('exit') == 0:
+            profiles.setdefault('{}/{}'.format(run['codename'], run['arch']),
+                                []).append(run)
+    for profile, done in sorted(profiles.items()):
+        last, before = done[-1], done[-window - 1:-1]
+        typical = ', median {}'.format(duration(median(
+            [a['total'] for a in before]))) if before else ''
+        report.append(('info', '{}: {} runs, last took {}{}'.format(
+            profile, len(done), duration(last['total']), typical)))
+        for group, label in (('phases', 'phase'), ('steps', 'step')):
+            for name, took in sorted(last[group].items()):
+                past = [a[group][name] for a in before if name in a[group]]
+                if not past:
+                    continue
+                usual = median(past)
+                if took > usual * factor and took - usual > slack:
+                    report.append(('regression', '{} {} on {} went from {} '
+                        'to {}'.format(label, name, profile, duration(usual),
+                                       duration(took))))
+    return report
+
+
+def synthetic_stream(records=100000):
+    ' return a fake vagrant up --machine-readable output, for benchmarks '
+    lines, now = [], 1382434354
+    for i in range(records):
+        if i < records // 10:
+            text = 'ui,detail,Progress: {}% (Rate: 9M/s%!(VAGRANT_COMMA) ' \
+                'Estimated time remaining: 0:00:{})'.format(
+                    i * 1000 // records, i % 60)
+        elif i % 500 == 0:
+            text = 'ui,info,==> default: {}...'.format(
+                PHASES[i // 500 % len(PHASES)][1])
+        elif i % 97 == 0:
+            text = 'ui,output,vagrant-ninja: step s{} done in {}s'.format(
+                i, i % 60)
+        else:
+            text = 'ui,output,[packages] Unpacking libfoo{} (1.{}-1) ...' \
+                '\\nSetting up libfoo{}'.format(i, i, i)
+        lines.append('{},default,{}'.format(now + i // 100, text))
+    return '\n'.join(lines) + '\n'
+
+
+def benchmark_parser(text, chunk=4096, rounds=3):
+    ' feed text to a parser in chunks, return the best MB/s and events '
+    best, events = 0, 0
+    for i in range(rounds):
+        parser, begin = ProgressParser(), time()
+        events = sum(len(parser.feed(text[a:a + chunk]))
+                     for a in range(0, len(text), chunk))
+        events += len(parser.close())
+        best = max(best, len(text) / 1048576.0 / max(time() - begin, 1e-9))
+    return best, events
+
+
+def check_specs(specs):
+    ' return specs, raise ValueError on unknown options or duplicated names '
+    for opts in specs:
+        if set(opts) - set(DEFAULTS):
+            raise ValueError('Unknown options {} for {}'.format(', '.join(
+                sorted(set(opts) - set(DEFAULTS))), opts['name']))
+        if opts['syncmode'] not in SYNCMODES:
+            raise ValueError('Unknown syncmode {} for {}, use {}'.format(
+                opts['syncmode'], opts['name'], ', '.join(sorted(SYNCMODES))))
+    names = [a['name'] for a in specs]
+    if len(set(names)) != len(names):
+        raise ValueError('Duplicated VM names {}'.format(', '.join(sorted(
+            set(a for a in names if names.count(a) > 1)))))
+    return specs
+
+
+def load_manifest(filename, defaults=DEFAULTS):
+    ' return the options of every VM of a JSON, YAML or fleet manifest '
+    with open(filename) as f:
+        text = f.read()
+    if filename.endswith('.json'):
+        data = loads(text)
+    elif not filename.endswith(('.yml', '.yaml')):
+        data = parse_fleet(text, defaults)
+    elif yaml is not None:
+        data = yaml.safe_load(text)
+    else:
+        raise ImportError('PyYAML is needed to read {}'.format(filename))
+    common, vms = (dict(defaults, **data.get('defaults', {})), data.get(
+        'vms', [])) if isinstance(data, dict) else (dict(defaults), data)
+    return check_specs([dict(common, **a) for a in vms])
+
+
+def prepare_vms(specs, jobs=None, log=echo):
+    ' fill the box cache with the boxes the VMs of specs need '
+    boxes = dict(('{}-{}'.format(a['codename'], a['arch']), a)
+                 for a in specs if a['boxcache'] is True and not cached_box(a))
+
+    def fetch(opts):
+        ' cache one box, log instead of raising so the others go on '
+        try:
+            log('INFO: Cached {}'.format(cache_box(opts)))
+        except Exception as reason:
+            log('ERROR: Box {}-{}: {}'.format(opts['codename'], opts['arch'],
+                                              reason))
+    if boxes:
+        pool = ThreadPool(min(len(boxes), jobs or cpu_count()))
+        pool.map(fetch, list(boxes.values()))
+        pool.close()
+
+
+def up_vm(opts, admission=None, chrt=False, log=echo, destroy=False):
+    ' bring the VM of opts up to date with vagrant, return its exit code '
+    name, timer = opts['name'], RunTimer(opts)
+    action, fingerprint = vm_action(opts), vm_fingerprint(opts)
+    if action == 'rebuild' and destroy is not True:
+        log('ERROR: [{}] Box changed, use --destroy to destroy the VM and '
+            'create it again'.format(name))
+        return 1
+    while admission is not None:
+        admitted, sized = admission.request(opts)
+        if admitted:
+            opts = sized
+            break
+        log('INFO: [{}] Held for {}s, {}'.format(name, ADMITHOLD, sized))
+        timer.lap('held')
+        sleep(ADMITHOLD)
+    base = path.join(BASE, name) if action == 'resume' else write_vm(opts)
+    log('INFO: [{}] {} in {}'.format(name, ACTIONS[action][1], base))
+    timer.lap('up')
+    parser = ProgressParser()
+    with codecs_open(path.join(base, 'vagrant_ninja.log'), 'a', 'utf-8') as f:
+        command = ['vagrant'] + ACTIONS[action][0].split() + [
+            '--machine-readable']
+        if action == 'rebuild':
+            command = ['sh', '-c', 'vagrant destroy --force && ' + ' '.join(
+                command)]
+        process = Popen((['chrt', '-i', '0'] if chrt else []) + command,
+                        cwd=base, stdout=PIPE, stderr=STDOUT)
+        for line in chain(iter(process.stdout.readline, b''), [b'\n']):
+            for kind, text, value in parser.feed(line):  # \n flushes the last
+                timer.event(kind, text, value)
+                f.write(text + u'\n')
+                if kind in ('phase', 'step', 'error', 'port'):
+                    log(u'[{}] {}'.format(name, text))
+        code = process.wait()
+    if admission is not None:
+        admission.release(name)
+    entry = timer.record(code)
+    save_history(entry)
+    if code == 0:
+        save_json(path.join(base, FINGERPRINT), fingerprint)
+    log('{}: [{}] exit {} after {}'.format('INFO' if code == 0 else 'ERROR',
+        name, code, duration(entry['total'])))
+    return code
+
+
+class LockedAdmission(Admission):
+    " Admission for VMs started from many threads at once "
+    def __init__(self, *args, **kwargs):
+        " Init LockedAdmission Class "
+        super(LockedAdmission, self).__init__(*args, **kwargs)
+        self.lock = Lock()
+
+    def request(self, opts):
+        ' return (True, sized opts) if opts fits the host, else (False, why) '
+        with self.lock:
+            return super(LockedAdmission, self).request(opts)
+
+    def release(self, name):
+        ' forget the booking of a VM that failed or has finished booting '
+        with self.lock:
+            super(LockedAdmission, self).release(name)
+
+
+def cli(args=None):
+    ' render or bring up the VMs of a manifest, report or benchmark '
+    parser = ArgumentParser(prog='generator.py', description=__doc__)
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True  # Python 3 made sub commands optional
+    for name, about in (('render', 'write the Vagrantfile of every VM'),
+                        ('up', 'render and bring up every VM in parallel')):
+        command = commands.add_parser(name, help=about)
+        command.add_argument('manifest', help='.json, .yml or fleet lines')
+        command.add_argument('--jobs', type=int, default=cpu_count(),
+                             help='VMs or boxes at once')
+        if name == 'render':  # writing files should not download boxes
+            command.add_argument('--prepare', action='store_true',
+                                 help='fill the box cache first')
+        if name == 'up':
+            command.add_argument('--no-prepare', dest='prepare',
+                                 action='store_false',
+                                 help='do not fill the box cache first')
+            command.add_argument('--admit', action='store_true',
+                                 help='hold VMs that would overcommit host')
+            command.add_argument('--chrt', action='store_true',
+                                 help='run vagrant at LOW CPU priority')
+            command.add_argument('--destroy', action='store_true',
+                                 help='destroy VMs whose box changed')
+    commands.add_parser('report', help='timing regressions of the history')
+    bench = commands.add_parser('bench', help='progress parser throughput')
+    bench.add_argument('--records', type=int, default=100000)
+    bench.add_argument('--chunk', type=int, default=4096)
+    args = parser.parse_args(args)
+    if args.command == 'report':
+        for kind, line in regression_report(load_history()):
+            print('{}: {}'.format(kind.upper(), line))
+        return 0
+    if args.command == 'bench':
+        text = synthetic_stream(args.records)
+        speed, events = benchmark_parser(text, args.chunk)
+        print('{:.1f} MB, {} events, {:.1f} MB/s'.format(
+            len(text) / 1048576.0, events, speed))
+        return 0
+    try:
+        specs = load_manifest(args.manifest)
+    except (IOError, ValueError, ImportError) as reason:
+        parser.error(str(reason))
+    if args.prepare:
+        prepare_vms([a for a in specs if vm_action(a) in ('create',
+                     'rebuild')], args.jobs)
+    if args.command == 'render':
+        for opts in specs:
+            print('{} {} {}'.format(opts['name'], vm_action(opts),
+                                    write_vm(opts)))
+        return 0
+    admission = LockedAdmission() if args.admit else None
+    pool = ThreadPool(max(1, min(args.jobs, len(specs))))
+    codes = pool.map(lambda opts: up_vm(opts, admission, args.chrt,
+                                        destroy=args.destroy), specs)
+    pool.close()
+    print('{} OK, {} FAIL of {}'.format(codes.count(0), len(codes) -
+                                        codes.count(0), len(codes)))
+    return 0 if codes.count(0) == len(codes) else 1
+
+
+if __name__ == "__main__":
+    exit(cli())
@@ -31,12 +31,23 @@ __full_licence__ = ''
 
 
 # imports
-from os import environ, linesep, chmod, remove, path, chdir, makedirs
+from os import environ, linesep, chmod, path, makedirs, pathsep, killpg
 from sip import setapi
 from datetime import datetime
+from time import time
+from json import dumps, loads
+from re import search, sub
+from xml.sax.saxutils import escape, unescape
 from subprocess import check_output as getoutput
 from random import choice
+from signal import SIGKILL, SIGTERM
 from getpass import getuser
+from collections import deque
+from multiprocessing import cpu_count
+from threading import Thread
+from sys import argv, executable
+from tempfile import mkdtemp
+from codecs import open as codecs_open
 
 try:
     from os import startfile
@@ -46,9 +57,11 @@ except ImportError:
 from PyQt4.QtGui import (QLabel, QCompleter, QDirModel, QPushButton, QMenu,
     QDockWidget, QVBoxLayout, QLineEdit, QIcon, QCheckBox, QColor, QMessageBox,
     QGraphicsDropShadowEffect, QGroupBox, QComboBox, QTabWidget, QButtonGroup,
-    QAbstractButton, QScrollArea, QSpinBox)
+    QAbstractButton, QScrollArea, QSpinBox, QProgressBar, QApplication,
+    QListWidget)
 
-from PyQt4.QtCore import Qt, QDir, QProcess, QUrl
+from PyQt4.QtCore import (Qt, QDir, QProcess, QUrl, QTimer, QEventLoop,
+    QEvent)
 
 from PyQt4.QtNetwork import QNetworkProxy
 
@@ -59,6 +72,17 @@ except ImportError:
 
 from ninja_ide.core import plugin
 
+from generator import (BASE, DEFAULTS, ACTIONS, ADMITHOLD, APTCACHEDIR,
+    BOXES, FINGERPRINT, GOLDEN, GOLDENSH, POOL, POOLFILE, PROJECT, REHOST,
+    WHEELDIR, Admission, ProgressParser, RunTimer, as_text, backend_key,
+    benchmark_parser, box_url, cache_box, cached_box, check_specs, duration,
+    golden_box, golden_name, load_history, load_json, median, parse_fleet,
+    parse_global_status, parse_runningvms, pool_claim, pool_mark, pool_new,
+    pool_profile, pool_vms, process_age, regression_report,
+    render_bootstrap, render_config, save_history, save_json,
+    synced_by_rsync, synthetic_stream, vm_action, vm_fingerprint,
+    vm_folders, which, write_vm)
+
 
 # API 2
 (setapi(a, 2) for a in ("QDate", "QDateTime", "QString", "QTime", "QUrl",
@@ -84,36 +108,531 @@ dependencies, all configured same way. Say goodbye to "works on my machine" bugs
 <a href="http://virtualbox.org">Virtualbox.org</a><br><br>
 ''' + ''.join((__doc__, __version__, __license__, 'by', __author__, __email__))
 
-VBOXGUI = '''
-    config.vm.provider :virtualbox do |vb|
-        vb.gui = true  # false for NO GUI
-        vb.customize ["modifyvm", :id, "--memory", "{}"]  # RAM for VM
-        vb.customize ["modifyvm", :id, "--cpuexecutioncap", "{}"]  # CPU for VM
-    end
-'''
+CACHE = path.join(BASE, '.vagrant_ninja_cache.json')
 
-APTGET_PROXY = '''# proxy support for the VM
-echo "Acquire::http::Proxy 'http://{}';" | tee /etc/apt/apt.conf.d/99proxy
-echo "Acquire::https::Proxy 'https://{}';" >> /etc/apt/apt.conf.d/99proxy
-echo "Acquire::ftp::Proxy 'ftp://{}';" >> /etc/apt/apt.conf.d/99proxy
-export http_proxy='http://{}'
-export https_proxy='https://{}'
-export ftp_proxy='ftp://{}'
-'''
+BACKENDS = ('vagrant', 'vboxmanage')
 
-CONFIG = '''
-Vagrant.configure("2") do |config|
-    config.vm.box = "{}"
-    config.vm.hostname = "{}"
-    config.vm.box_url = "{}://cloud-images.ubuntu.com/vagrant/{}/current/{}-server-cloudimg-{}-vagrant-disk1.box"
-    config.vm.provision :shell, :path => "bootstrap.sh"
+STATUSTTL = 30  # seconds a machine state is trusted before asking again
 
-{}
-    {}
-end
+LOGLINES = 1000  # lines kept on the output widget, the .log keeps them all
+
+FAKEVAGRANT = '''#!{}
+# fake vagrant binary for benchmarks, replays a --machine-readable stream
+import sys
+if '--version' in sys.argv:
+    sys.stdout.write('Vagrant 1.3.5\\n')
+elif 'up' in sys.argv:
+    sys.stdout.write(open({!r}).read())
 '''
 
-BASE = path.abspath(path.join(path.expanduser("~"), 'vagrant'))
+FLEETMSG = '''# one VM per line: name codename arch ram cpu apt-packages...
+# mars saucy amd64 1024 99 build-essential git
+# venus precise i386 512 50 vim'''
+
+
+###############################################################################
+
+
+class LogSink(object):
+    " Stream log lines to a .log file, show only the last ones on a widget "
+    def __init__(self, widget=None, lines=LOGLINES, interval=250,
+                 forward=None):
+        " Init LogSink Class "
+        self.widget, self.ring, self.pending = None, deque(maxlen=lines), []
+        self.logfile, self.shown, self.forward = None, 0, forward
+        if widget is not None:
+            self.attach(widget, interval)
+
+    def attach(self, widget, interval=250):
+        ' start showing the last messages, and the new ones, on widget '
+        self.widget, self.pending, self.shown = widget, list(self.ring), 0
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.flush)
+        self.timer.start(interval)
+
+    def open(self, filename):
+        ' start streaming to a new .log file, closing the previous one '
+        self.close()
+        self.logfile = codecs_open(filename, 'w', 'utf-8')
+
+    def close(self):
+        ' stop streaming to the .log file '
+        if self.logfile is not None:
+            self.logfile.close()
+            self.logfile = None
+
+    def append(self, html, show=True):
+        ' queue one html formatted message for the widget and the .log file '
+        if show is True:
+            self.ring.append(html)
+        if show is True and self.widget is not None:
+            self.pending.append(html)
+        if self.logfile is not None:
+            self.logfile.write(unescape(sub('<[^>]*>', '', html)) + linesep)
+            self.logfile.flush()
+        if self.forward is not None:  # a job sink also shows on the main one
+            self.forward.append(html, show)
+
+    def write(self, text, color=None, show=True):
+        ' queue raw process output, one message per line '
+        for line in as_text(text).splitlines():
+            self.append(u'<font color="{}">{}</font>'.format(color, escape(
+                line)) if color is not None else escape(line), show)
+
+    def clear(self):
+        ' forget every message and clear the widget '
+        self.ring.clear()
+        self.pending, self.shown = [], 0
+        if self.widget is not None:
+            self.widget.clear()
+
+    def flush(self):
+        ' show queued messages on the widget, in a single update '
+        if not self.pending or self.widget is None:
+            return
+        if self.shown + len(self.pending) > self.ring.maxlen * 2:
+            self.widget.setHtml('<br>'.join(self.ring))
+            self.shown = len(self.ring)
+        else:
+            self.widget.append('<br>'.join(self.pending))
+            self.shown += len(self.pending)
+        self.pending = []
+        self.widget.ensureCursorVisible()
+
+
+class BoxFetcher(object):
+    " Fill the local box cache on a thread, report its progress on the UI "
+    def __init__(self, specs, log, done):
+        " Init BoxFetcher Class "
+        self.specs = dict((('{}-{}'.format(a['codename'], a['arch']), a)
+                           for a in specs if not cached_box(a)))
+        self.log, self.done, self.progress, self.errors = log, done, {}, {}
+        self.cancelled = False
+        self.thread = Thread(target=self._run)
+        self.thread.daemon = True
+        self.timer = QTimer()
+        self.timer.timeout.connect(self._poll)
+        self.timer.start(2000)
+        self.thread.start()
+
+    def _run(self):
+        ' download every missing box, runs on the thread '
+        for key, opts in self.specs.items():
+            try:
+                cache_box(opts, lambda done, total, k=key:
+                          self._progress(k, done, total))
+            except Exception as reason:
+                self.errors[key] = reason
+
+    def _progress(self, key, done, total):
+        ' record the progress of one box, abort its download on kill '
+        if self.cancelled is True:
+            raise IOError('Box caching cancelled')
+        self.progress[key] = (done, total)
+
+    def _poll(self):
+        ' report the progress, call done when the thread has finished '
+        if self.cancelled is True:
+            return self.timer.stop()  # the thread stops on its next chunk
+        for key, (done, total) in sorted(self.progress.items()):
+            if done < total:
+                self.log('INFO: Caching box {}: {} of {} MB'.format(
+                    key, done // 1048576, total // 1048576))
+        if self.thread.is_alive():
+            return
+        self.timer.stop()
+        for key, reason in self.errors.items():
+            self.log('ERROR: Box {} not cached, using remote URL: {}'.format(
+                key, reason), 'red')
+        self.done()
+
+    def kill(self):
+        ' stop caching boxes, without going on with the next stage '
+        self.cancelled = True
+        self.log('INFO: Box caching cancelled')
+
+
+class GoldenBuilder(object):
+    " Provision and package the missing golden images, one after another "
+    def __init__(self, specs, jobs, log, done, chrt=True):
+        " Init GoldenBuilder Class "
+        self.pending = deque(dict(((golden_name(a), a) for a in specs if
+            a['golden'] is True and not golden_box(a))).values())
+        self.jobs, self.log, self.done, self.chrt = jobs, log, done, chrt
+        self.job = None
+        self.start()
+
+    def start(self):
+        ' build the next golden image, or call done when there is none left '
+        if not self.pending:
+            return self.done()
+        opts = self.pending.popleft()
+        name = golden_name(opts)
+        base = write_vm(dict(opts, name=name, gui=False, golden=False),
+                        path.join(GOLDEN, name))
+        self.started = datetime.now()
+        self.job = Job(base, '{}sh -c "{}"'.format('chrt --verbose -i 0 '
+            if self.chrt is True else '', GOLDENSH), 'golden ' + name,
+            lambda job, text: self.log(u'[golden] ' + as_text(text)),
+            lambda job, text: self.log(u'[golden] ' + as_text(text), 'red'),
+            lambda job, code, n=name: self._finished(n, code))
+        self.log('INFO: Building golden image {} in {}'.format(name, base))
+        self.jobs.submit(self.job)
+
+    def _finished(self, name, code):
+        ' report one golden image and go on with the next one '
+        self.log('INFO: Golden image {} {} after {}'.format(name, 'OK' if
+            code == 0 else 'FAIL: exit {}'.format(code), datetime.now() -
+            self.started), 'green' if code == 0 else 'red')
+        if self.job.state == 'cancelled':
+            return self.pending.clear()  # stopped, no VM up after it
+        self.start()
+
+    def kill(self):
+        ' drop the queue and kill the running golden image build '
+        self.pending.clear()
+        if self.job is not None:
+            self.jobs.cancel(self.job, True)
+
+
+class StatusMonitor(object):
+    " Cache the state of every Vagrant machine, got from a single call "
+    def __init__(self, changed, ttl=STATUSTTL):
+        " Init StatusMonitor Class "
+        self.machines, self.updated, self.process = {}, 0, None
+        self.changed, self.ttl = changed, ttl
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(ttl * 2000)
+
+    def refresh(self, force=False):
+        ' ask the backend in background, unless the cache is still fresh '
+        if self.process is not None or (not force and
+                                        time() - self.updated < self.ttl):
+            return
+        self.process = QProcess()
+        self.process.finished.connect(self._finished)
+        self.process.error.connect(self._finished)
+        if which('vagrant'):
+            self.parse = parse_global_status
+            self.process.start(which('vagrant'), ['global-status',
+                                                  '--machine-readable'])
+        elif which('vboxmanage'):
+            self.parse = lambda text: parse_runningvms(text, vm_folders())
+            self.process.start(which('vboxmanage'), ['list', 'runningvms'])
+        else:
+            self.process = None
+
+    def _finished(self, *args):
+        ' update the cached machines and tell the UI '
+        if self.process is None:
+            return
+        process, self.process = self.process, None
+        process.deleteLater()  # still emitting, Qt frees it after the slot
+        self.machines = self.parse(process.readAllStandardOutput())
+        self.updated = time()
+        self.changed(self)
+
+    def state(self, home):
+        ' return the cached state of the machine at home, refresh if old '
+        self.refresh()
+        return self.machines.get(path.realpath(home), {}).get('state',
+                                                              'unknown')
+
+
+class Fleet(object):
+    " Bring up many VMs at once, each one as a job on its own folder "
+    def __init__(self, specs, limit, jobs, log, chrt=True, done=None,
+                 admission=None):
+        " Init Fleet Class "
+        self.pending, self.running, self.results = deque(specs), {}, {}
+        self.limit, self.jobs, self.log = limit, jobs, log
+        self.chrt, self.done = chrt, done
+        self.started, self.total = datetime.now(), len(specs)
+        self.admission, self.held = admission, False
+
+    def start(self):
+        ' start as many VMs as the concurrency limit and the host allow '
+        self.held = False
+        while self.pending and len(self.running) < self.limit:
+            opts = self.pending.popleft()
+            name = opts['name']
+            if self.admission is not None:
+                admitted, sized = self.admission.request(opts)
+                if not admitted:
+                    self.pending.appendleft(opts)
+                    self.log('INFO: [{}] Held for {}s, {}'.format(
+                        name, ADMITHOLD, sized))
+                    self.held = True
+                    QTimer.singleShot(ADMITHOLD * 1000, lambda:
+                                      self.start() if self.held else None)
+                    break
+                opts = sized
+                self.log('INFO: [{}] Sized to {} MB, {} cores at {}%'.format(
+                    name, opts['ram'], opts['cpus'], opts['cpu']))
+            try:
+                base = write_vm(opts)
+            except Exception as reason:
+                self.results[name] = 'FAIL: {}'.format(reason)
+                self.log('ERROR: [{}] {}'.format(name, reason), 'red')
+                if self.admission is not None:
+                    self.admission.release(name)
+                continue
+            sink = LogSink()
+            sink.open(path.join(base, 'vagrant_ninja.log'))
+            job = Job(base, '{}vagrant up --machine-readable'.format(
+                'chrt --verbose -i 0 ' if self.chrt is True else ''),
+                'fleet ' + name, self._output, self._error, self._finished)
+            job.timer = RunTimer(opts)
+            self.running[name] = (job, datetime.now(), sink)
+            self.jobs.submit(job)
+            self.log('INFO: [{}] Vagrant Up in {} ({} running, {} queued)'
+                .format(name, base, len(self.running), len(self.pending)))
+        if not self.pending and not self.running and not self.held:
+            ok = len([a for a in self.results.values() if a == 'OK'])
+            self.log('INFO: Fleet finished in {}: {} OK, {} FAIL of {}'.format(
+                datetime.now() - self.started, ok, self.total - ok,
+                self.total))
+            if self.done is not None:
+                self.done(self)
+
+    def _output(self, job, text):
+        ' stream the output of one VM to its .log, its progress to the log '
+        name = job.timer.opts['name']
+        for kind, line, value in job.parser.feed(text):
+            job.timer.event(kind, line, value)
+            self.running[name][2].write(line, 'red' if kind == 'error'
+                                        else None)
+            if kind in ('phase', 'step', 'error', 'port'):
+                failed = kind == 'error' or (kind == 'step' and
+                                             'failed' in value)
+                self.log(u'[{}] {}'.format(name, line), 'red' if failed
+                         else 'green')
+
+    def _error(self, job, text):
+        ' stream the errors of one VM to its .log file and the fleet log '
+        name = job.timer.opts['name']
+        self.running[name][2].write(text, 'red')
+        self.log(u'[{}] {}'.format(name, as_text(text)), 'red')
+
+    def _finished(self, job, code):
+        ' record the exit status of one VM and start the next queued one '
+        self._output(job, '\n')  # flush an unterminated last record
+        name = job.timer.opts['name']
+        job, begin, sink = self.running.pop(name)
+        sink.close()
+        if self.admission is not None:
+            self.admission.release(name)
+        save_history(job.timer.record(code))
+        self.results[name] = 'OK' if code == 0 else 'FAIL: exit {}'.format(
+            code)
+        self.log('INFO: [{}] {} after {}, {} of {} done'.format(
+            name, self.results[name], datetime.now() - begin,
+            len(self.results), self.total), 'green' if code == 0 else 'red')
+        self.start()
+
+    def kill(self):
+        ' drop the queue and kill every running VM job '
+        self.pending.clear()
+        self.held, idle = False, not self.running
+        for job, begin, sink in list(self.running.values()):
+            self.jobs.cancel(job, True)
+        if idle:  # held, no job would finish and report it
+            self.start()
+
+
+class Job(object):
+    " One command to run on its own QProcess in a project folder "
+    def __init__(self, folder, command, name, output=None, error=None,
+                 done=None):
+        " Init Job Class "
+        self.folder, self.command, self.name = folder, command, name
+        self.output, self.error, self.done = output, error, done
+        self.process, self.begin, self.state = None, None, 'queued'
+        self.parser, self.timer = ProgressParser(), None
+        self.fingerprint = None  # config hashes to save once the job is OK
+        self.sink = None  # LogSink of the job, with its own .log file
+
+
+class JobManager(object):
+    " One queue of commands per project folder, the folders run at once "
+    def __init__(self, changed=None, grace=10):
+        " Init JobManager Class "
+        self.queues, self.running = {}, {}
+        self.changed, self.grace = changed, grace
+        self.setsid = 'setsid ' if which('setsid') else ''  # own group
+
+    def submit(self, job):
+        ' queue job after the other commands of its folder, return it '
+        job.folder = path.realpath(job.folder)
+        self.queues.setdefault(job.folder, deque()).append(job)
+        self._next(job.folder)
+        self._changed()
+        return job
+
+    def _next(self, folder):
+        ' start the next queued job of folder, unless one is running there '
+        queue = self.queues.get(folder)
+        if folder in self.running or not queue:
+            return
+        job = queue.popleft()
+        job.process, job.begin = QProcess(), datetime.now()
+        job.state = 'running'
+        self.running[folder] = job
+        job.process.setWorkingDirectory(folder)
+        job.process.readyReadStandardOutput.connect(lambda j=job:
+            j.output(j, j.process.readAllStandardOutput()) if j.output else
+            j.process.readAllStandardOutput())
+        job.process.readyReadStandardError.connect(lambda j=job:
+            j.error(j, j.process.readAllStandardError()) if j.error else
+            j.process.readAllStandardError())
+        job.process.finished.connect(lambda c=0, s=0, j=job: self._finished(j))
+        job.process.error.connect(lambda e=0, j=job: self._finished(j, False)
+                                  if e == QProcess.FailedToStart else None)
+        job.process.start(self.setsid + job.command)
+
+    def _finished(self, job, started=True):
+        ' record the exit code of job and start the next one of its folder '
+        if self.running.get(job.folder) is not job:
+            return  # already finished, a crash emits error and finished
+        self.running.pop(job.folder)
+        code = job.process.exitCode() if started and (job.process.exitStatus()
+            == QProcess.NormalExit) else -1
+        if job.state == 'running':
+            job.state = 'done' if code == 0 else 'failed'
+        if job.done is not None:
+            job.done(job, code)
+        self._next(job.folder)
+        self._changed()
+
+    def cancel(self, job, force=False):
+        ' drop a queued job, terminate a running one and kill it if it hangs '
+        if job.state == 'queued':
+            self.queues[job.folder].remove(job)
+            job.state = 'cancelled'
+            if job.done is not None:
+                job.done(job, -1)
+            self._changed()
+        elif job.state == 'running':
+            job.state = 'cancelled'
+            if force is True:
+                return self._signal(job, SIGKILL)
+            self._signal(job, SIGTERM)
+            QTimer.singleShot(self.grace * 1000, lambda: self._signal(
+                job, SIGKILL) if self.running.get(job.folder) is job else None)
+
+    def kill(self):
+        ' drop every queue and kill every running job at once '
+        for job in [a for b in self.queues.values() for a in b]:
+            self.cancel(job)
+        for job in list(self.running.values()):
+            job.state = 'cancelled'
+            self._signal(job, SIGKILL)
+        self._changed()
+
+    def _signal(self, job, signal):
+        ' send signal to job and every process it started, like vagrant '
+        pid = job.process.pid()
+        if self.setsid and pid > 0:  # pid 0 would be the group of the IDE
+            try:
+                return killpg(pid, signal)
+            except OSError:
+                pass  # gone, or not a group leader: the process alone
+        job.process.kill() if signal == SIGKILL else job.process.terminate()
+
+    def jobs(self):
+        ' return the running jobs, then the queued ones in order '
+        return list(self.running.values()) + [a for b in self.queues.values()
+                                              for a in b]
+
+    def idle(self):
+        ' return True when no job is running or queued '
+        return not self.jobs()
+
+    def _changed(self):
+        ' tell whoever shows the jobs that they changed '
+        if self.changed is not None:
+            self.changed()
+
+
+class AutoSync(object):
+    " Keep a vagrant rsync-auto running for each VM synced with rsync "
+    def __init__(self, log):
+        " Init AutoSync Class "
+        self.log, self.processes = log, {}
+
+    def start(self, folder):
+        ' start re-syncing the VM in folder on changes, unless it already is '
+        if folder in self.processes:
+            return
+        process = QProcess()
+        process.setWorkingDirectory(folder)
+        process.setProcessChannelMode(QProcess.MergedChannels)
+        process.readyReadStandardOutput.connect(lambda p=process:
+            self.log(p.readAllStandardOutput()))
+        process.finished.connect(lambda c=0, s=0, f=folder, p=process:
+            self.processes.pop(f) if self.processes.get(f) is p else None)
+        self.processes[folder] = process
+        process.start('vagrant rsync-auto')
+
+    def stop(self, folder=None):
+        ' stop re-syncing the VM in folder, or every VM '
+        for each in [folder] if folder else list(self.processes):
+            process = self.processes.pop(each, None)
+            if process is not None:
+                process.terminate()
+
+
+class WarmPool(object):
+    " Keep provisioned VMs suspended per profile, hand them out in seconds "
+    def __init__(self, jobs, log):
+        " Init WarmPool Class "
+        self.jobs, self.log, self.filling = jobs, log, {}
+
+    def claim(self, opts, base):
+        ' hand a ready VM of the pool of opts out as base, return its name '
+        return pool_claim(opts, base)
+
+    def refill(self, opts, size, chrt=True, admission=None):
+        ' start filling the pool of opts up to size VMs, at idle priority '
+        stale = [a for a in pool_vms(opts, ('filling', 'failed'))
+                 if path.realpath(a) not in self.filling]
+        profile = pool_profile(opts)  # the name of opts does not count
+        while len(pool_vms(opts)) + len([a for a in self.filling.values()
+                                         if a[1] == profile]) < size:
+            folder = stale.pop(0) if stale else pool_new(opts)
+            name = load_json(path.join(folder, POOLFILE), {})['name']
+            if admission is not None and not admission.request(dict(opts,
+                                                            name=name))[0]:
+                self.log('INFO: Warm pool refill held, host is busy')
+                break
+            self.filling[path.realpath(folder)] = (admission, profile)
+            job = Job(folder, '{}sh -c "vagrant up && vagrant suspend"'.format(
+                'chrt --verbose -i 0 ' if chrt else ''), 'pool ' + name,
+                self._output, lambda job, text: job.sink.write(text, 'red'),
+                self._filled)
+            job.sink = LogSink()
+            job.sink.open(path.join(folder, 'vagrant_ninja.log'))
+            self.jobs.submit(job)
+            self.log('INFO: Warm pool filling {}'.format(folder))
+
+    def _output(self, job, text):
+        ' stream the output of one pool VM to its .log file '
+        for kind, line, value in job.parser.feed(text):
+            job.sink.write(line, 'red' if kind == 'error' else None)
+
+    def _filled(self, job, code):
+        ' mark a pool VM ready once it is provisioned and suspended '
+        self._output(job, '\n')  # flush an unterminated last line
+        job.sink.close()
+        admission, profile = self.filling.pop(job.folder)
+        if admission is not None:
+            admission.release(job.name.split()[-1])
+        pool_mark(job.folder, state='ready' if code == 0 else 'failed')
+        self.log('{}: Warm pool {} {}'.format('INFO' if code == 0 else
+            'ERROR', job.folder, 'ready' if code == 0 else 'failed, exit {}, '
+            'see {}'.format(code, path.join(job.folder, 'vagrant_ninja.log'))),
+            'green' if code == 0 else 'red')
 
 
 ###############################################################################
@@ -124,31 +643,29 @@ class Main(plugin.Plugin):
     def initialize(self, *args, **kwargs):
         " Init Main Class "
         super(Main, self).initialize(*args, **kwargs)
-        self.completer, self.dirs = QCompleter(self), QDirModel(self)
-        self.dirs.setFilter(QDir.AllEntries | QDir.NoDotAndDotDot)
-        self.completer.setModel(self.dirs)
-        self.completer.setCaseSensitivity(Qt.CaseInsensitive)
-        self.completer.setCompletionMode(QCompleter.PopupCompletion)
+        self.started, self.completer = time(), None
 
         self.desktop, self.project, menu = '', '', QMenu('Vagrant')
         menu.addAction('UP', lambda: self.vagrant_c('up'))
         menu.addAction('HALT', lambda: self.vagrant_c('halt'))
         menu.addAction('RELOAD', lambda: self.vagrant_c('reload'))
-        menu.addAction('STATUS', lambda: self.vagrant_c('status'))
+        menu.addAction('STATUS', self.show_status)
         menu.addAction('SUSPEND', lambda: self.vagrant_c('suspend'))
         menu.addAction('RESUME', lambda: self.vagrant_c('resume'))
         menu.addAction('PROVISION', lambda: self.vagrant_c('provision'))
         menu.addAction('PACKAGE', lambda: self.vagrant_c('package'))
+        menu.addAction('RSYNC', lambda: self.vagrant_c('rsync'))
+        menu.addAction('I/O BENCHMARK', lambda: self.vagrant_c(
+            'ssh -c "bash /vagrant/iobench.sh"'))
         menu.addAction('INIT', lambda: self.vagrant_c('init'))
         menu.addSeparator()
         menu.addAction('DESTROY (!!!)', lambda: self.vagrant_c('destroy'))
         self.locator.get_service('explorer').add_project_menu(menu, lang='all')
 
-        self.process = QProcess()
-        self.process.readyReadStandardOutput.connect(self.readOutput)
-        self.process.readyReadStandardError.connect(self.readErrors)
-        self.process.finished.connect(self._process_finished)
-        self.process.error.connect(self._process_finished)
+        self.jobs, self.logs = JobManager(self.show_jobs), LogSink()
+        self.autosync = AutoSync(lambda text: self.logs.write(text, 'gray'))
+        self.pool = WarmPool(self.jobs, lambda msg, color='green':
+                             self.logs.write(msg, color))
 
         # Proxy support, by reading http_proxy os env variable
         proxy_url = QUrl(environ.get('http_proxy', ''))
@@ -179,9 +696,16 @@ class Main(plugin.Plugin):
 
         self.tab1, self.tab2, self.tab3 = QGroupBox(), QGroupBox(), QGroupBox()
         self.tab4, self.tab5, self.tab6 = QGroupBox(), QGroupBox(), QGroupBox()
+        self.tab7, self.fleet, self.stages = QGroupBox(), None, []
+        self.tab8, self.status = QGroupBox(), None
+        self.makers = {self.tab1: self._make_tab1, self.tab2: self._make_tab2,
+            self.tab3: self._make_tab3, self.tab4: self._make_tab4,
+            self.tab5: self._make_tab5, self.tab6: self._make_tab6,
+            self.tab7: self._make_tab7, self.tab8: self._make_tab8}
         for a, b in ((self.tab1, 'Basics'), (self.tab2, 'General Options'),
             (self.tab3, 'VM Package Manager'), (self.tab4, 'VM Provisioning'),
-            (self.tab5, 'VM Desktop GUI'), (self.tab6, 'Run')):
+            (self.tab5, 'VM Desktop GUI'), (self.tab6, 'Run'),
+            (self.tab7, 'Fleet'), (self.tab8, 'Status')):
             a.setTitle(b)
             a.setToolTip(b)
             self.mainwidget.addTab(a, QIcon.fromTheme("virtualbox"), b)
@@ -189,7 +713,49 @@ class Main(plugin.Plugin):
         QPushButton(QIcon.fromTheme("help-about"), 'About', self.dock
         ).clicked.connect(lambda: QMessageBox.information(self.dock, __doc__,
         HELPMSG))
+        self.mainwidget.setCurrentIndex(5)
+        self.mainwidget.currentChanged.connect(self._tab_shown)
+        self.dock.visibilityChanged.connect(lambda visible: self._tab_shown(
+            self.mainwidget.currentIndex()) if visible else None)
+        if self.dock.isVisible():  # restored visible, no signal for that
+            self._tab_shown(self.mainwidget.currentIndex())
+        took, age = time() - self.started, process_age()
+        self.logs.append(self.formatInfoMsg('INFO: Plugin initialized in '
+            '{:.0f} ms, {:.1f}% of the {:.0f} ms the IDE has run'.format(
+            took * 1000, 100 * took / max(age, took, 1e-3), age * 1000)))
+
+    def _tab_shown(self, index):
+        ' build the tab at index the first time it is shown, refresh it '
+        self.build_tab(self.mainwidget.widget(index))
+        if self.mainwidget.widget(index) is self.tab8:
+            self.status.refresh()
 
+    def build_tab(self, tab):
+        ' fill tab with its widgets, only the first time it is needed '
+        make = self.makers.pop(tab, None)
+        if make is not None:
+            make()
+
+    def build_tabs(self):
+        ' fill every tab that is still empty, to read all the options '
+        for tab in (self.tab1, self.tab2, self.tab3, self.tab4, self.tab5,
+                    self.tab6, self.tab7, self.tab8):
+            self.build_tab(tab)
+
+    def eventFilter(self, watched, event):
+        ' create the filesystem completer on first focus of requirements '
+        if event.type() == QEvent.FocusIn and self.completer is None:
+            self.completer, self.dirs = QCompleter(self), QDirModel(self)
+            self.dirs.setFilter(QDir.AllEntries | QDir.NoDotAndDotDot)
+            self.completer.setModel(self.dirs)
+            self.completer.setCaseSensitivity(Qt.CaseInsensitive)
+            self.completer.setCompletionMode(QCompleter.PopupCompletion)
+            self.requirements.setCompleter(self.completer)
+            self.requirements.removeEventFilter(self)
+        return False
+
+    def _make_tab1(self):
+        ' Basics tab '
         self.vmname = QLineEdit(self.get_name())
         self.vmname.setPlaceholderText('type_your_VM_name_here_without_spaces')
         self.vmname.setToolTip('Type VM name, no spaces or special characters')
@@ -209,34 +775,64 @@ class Main(plugin.Plugin):
             QLabel('<b>Choose Architecture for VM:'), self.vmarch, self.target):
             vboxg1.addWidget(each_widget)
 
+    def _make_tab2(self):
+        ' General Options tab '
         self.chrt = QCheckBox('LOW CPU priority for Backend Process')
         self.chttps = QComboBox()
         self.chttps.addItems(['https', 'http'])
-        try:
-            self.vinfo1 = QLabel('''<b> Vagrant Backend Version: </b> {},
-                <b> VirtualBox Backend Version: </b> {}. '''.format(
-                getoutput('vagrant --version', shell=1).strip(),
-                getoutput('vboxmanage --version', shell=1).strip()))
-        except:
-            self.vinfo1 = QLabel('<b>Warning: Failed to query Vagrant Backend!')
+        self.vinfo1 = QLabel('<b>Querying Vagrant Backend Version...')
         self.qckb1 = QCheckBox(' Open target directory later')
         self.qckb1.setToolTip('Open the target directory when finished')
         self.qckb2 = QCheckBox(' Save a LOG file to target later')
         self.qckb2.setToolTip('Save a read-only .LOG file to target')
         self.qckb3 = QCheckBox(' NO run Headless Mode, use a Window')
         self.qckb3.setToolTip('Show the VM on a Window GUI instead of Headless')
-        self.cpu, self.ram = QSpinBox(), QSpinBox()
+        self.qckb4 = QCheckBox(' Cache VM boxes locally, download once')
+        self.qckb4.setToolTip('Keep a verified copy of boxes on ' + BOXES)
+        self.qckb5 = QCheckBox(' Golden image, provision once, clone later')
+        self.qckb5.setToolTip('Provision and package a base VM once on {}, '
+            'new VMs are linked clones of it'.format(GOLDEN))
+        self.qckb6 = QCheckBox(' Compact progress, full output on .LOG only')
+        self.qckb6.setToolTip('Show phases, steps and errors, not every line')
+        self.qckb7 = QCheckBox(' Hold builds that overcommit, size VM to fit')
+        self.qckb7.setToolTip('Check free RAM, cores and load on /proc first')
+        self.qckb8 = QCheckBox(' Share the current Ninja project on ' +
+                               PROJECT)
+        self.qckb8.setToolTip('Sync the open project into the VM, with the '
+                              'Synced Folders mode below')
+        self.syncmode = QComboBox()
+        self.syncmode.addItems(['virtualbox', 'nfs', 'rsync'])
+        self.syncmode.setToolTip('virtualbox is slow on many small files, nfs'
+            ' needs nfsd and sudo, rsync copies and re-syncs on changes')
+        self.cpu, self.ram, self.cpus = QSpinBox(), QSpinBox(), QSpinBox()
         self.cpu.setRange(25, 99)
         self.cpu.setValue(99)
         self.ram.setRange(512, 4096)
         self.ram.setValue(1024)
+        self.cpus.setRange(1, cpu_count())
+        self.cpus.setValue(1)
+        self.admission, self.poolsize = Admission(), QSpinBox()
+        self.poolsize.setRange(0, 8)
+        self.poolsize.setToolTip('Provisioned VMs kept suspended on {} per '
+            'codename, arch and packages, 0 to disable'.format(POOL))
         vboxg2 = QVBoxLayout(self.tab2)
-        for each_widget in (self.qckb1, self.qckb2, self.qckb3, self.chrt,
+        for each_widget in (self.qckb1, self.qckb2, self.qckb3, self.qckb4,
+            self.qckb5, self.qckb6, self.qckb7, self.qckb8, self.chrt,
+            QLabel('<b>Synced Folders Mode:</b>'), self.syncmode,
             QLabel('<b>Max CPU Limit for VM:</b>'), self.cpu,
+            QLabel('<b>Max CPU Cores for VM:</b>'), self.cpus,
             QLabel('<b>Max RAM Limit for VM:</b>'), self.ram,
+            QLabel('<b>Warm Pool of suspended VMs:</b>'), self.poolsize,
             QLabel('<b>Download Protocol Type:</b>'), self.chttps, self.vinfo1):
             vboxg2.addWidget(each_widget)
+        [a.setChecked(True) for a in (self.qckb1, self.qckb2, self.qckb3,
+            self.qckb4, self.qckb6, self.qckb7, self.qckb8, self.chrt)]
+        self.poolsize.valueChanged.connect(lambda size: self.refill_pool())
+        self.refill_pool()
+        self.probe_backends()
 
+    def _make_tab3(self):
+        ' VM Package Manager tab '
         self.qckb10 = QCheckBox('Run apt-get update on the created VM')
         self.qckb11 = QCheckBox('Run apt-get dist-upgrade on the created VM')
         self.qckb12 = QCheckBox('Run apt-get check on the created VM')
@@ -245,26 +841,45 @@ class Main(plugin.Plugin):
         self.qckb14 = QCheckBox('Try to Fix Broken packages if any on the VM')
         self.aptproxy, self.portredirect = QLineEdit(), QLineEdit('8000, 9000')
         self.aptproxy.setPlaceholderText(' user:password@proxyaddress:port ')
+        self.qckb15 = QCheckBox('Share a host APT package cache between VMs')
+        self.qckb15.setToolTip('Keep downloaded .deb on ' + APTCACHEDIR)
+        self.aptcacher = QLineEdit()
+        self.aptcacher.setPlaceholderText(' 10.0.2.2:3142 ')
+        self.aptcacherbtn = QPushButton(QIcon.fromTheme("network-server"),
+            'Start local APT caching proxy (apt-cacher-ng)')
+        self.aptcacherbtn.clicked.connect(self.start_aptcacher)
         vboxg3 = QVBoxLayout(self.tab3)
         for each_widget in (self.qckb10, self.qckb11, self.qckb12, self.qckb13,
-            self.qckb14,
+            self.qckb14, self.qckb15,
             QLabel('<b>Network Proxy for apt-get on the VM'), self.aptproxy,
+            QLabel('<b>APT only caching proxy for the VM'), self.aptcacher,
+            self.aptcacherbtn,
             QLabel('<b>Network Port Redirects for the VM'), self.portredirect):
             vboxg3.addWidget(each_widget)
+        [a.setChecked(True) for a in (self.qckb10, self.qckb11, self.qckb12,
+            self.qckb13, self.qckb14, self.qckb15)]
 
+    def _make_tab4(self):
+        ' VM Provisioning tab '
         self.aptpkg = QTextEdit('build-essential git python-pip vim mc wget')
         self.aptppa, self.pippkg = QLineEdit(), QTextEdit('virtualenv yolk')
         self.aptppa.setPlaceholderText(' ppa:ninja-ide-developers/daily ')
         self.requirements = QLineEdit()
         self.requirements.setPlaceholderText(' /full/path/to/requirements.txt ')
-        self.requirements.setCompleter(self.completer)
+        self.requirements.installEventFilter(self)
+        self.qckb16 = QCheckBox('Build PIP wheels once, install them offline')
+        self.qckb16.setToolTip('Shared wheelhouse on ' + WHEELDIR)
         vboxg4 = QVBoxLayout(self.tab4)
         for each_widget in (QLabel('<b>Custom APT Ubuntu package'), self.aptpkg,
             QLabel('<b>Custom APT Ubuntu PPA:</b>      '), self.aptppa,
             QLabel('<b>Custom PIP Python packages:</b> '), self.pippkg,
-            QLabel('<b>Custom PIP Python requirements: '), self.requirements):
+            QLabel('<b>Custom PIP Python requirements: '), self.requirements,
+            self.qckb16):
             vboxg4.addWidget(each_widget)
+        self.qckb16.setChecked(True)
 
+    def _make_tab5(self):
+        ' VM Desktop GUI tab '
         self.buttonGroup = QButtonGroup()
         self.buttonGroup.buttonClicked[QAbstractButton].connect(self.get_de_pkg)
         vboxg5 = QVBoxLayout(self.tab5)
@@ -276,8 +891,12 @@ class Main(plugin.Plugin):
             vboxg5.addWidget(button)
             self.buttonGroup.addButton(button)
 
+    def _make_tab6(self):
+        ' Run tab '
         self.output = QTextEdit('''
         We have persistent objects, they are called files.  -Ken Thompson. ''')
+        self.output.setReadOnly(True)
+        self.logs.attach(self.output)
         self.runbtn = QPushButton(QIcon.fromTheme("media-playback-start"),
             'Start Vagrant Instrumentation Now !')
         self.runbtn.setMinimumSize(75, 50)
@@ -289,19 +908,107 @@ class Main(plugin.Plugin):
         self.runbtn.setGraphicsEffect(glow)
         self.stopbt = QPushButton(QIcon.fromTheme("media-playback-stop"),
             'Stop Vagrant')
-        self.stopbt.clicked.connect(lambda: self.process.stop())
+        self.stopbt.clicked.connect(self.stop_jobs)
         self.killbt = QPushButton(QIcon.fromTheme("application-exit"),
             'Force Kill Vagrant')
-        self.killbt.clicked.connect(lambda: self.process.kill())
+        self.killbt.clicked.connect(lambda: self.stop_stages() or
+                                    self.jobs.kill())
+        self.joblist, self.shownjobs = QListWidget(), []
+        self.joblist.setMaximumHeight(100)
+        self.joblist.setToolTip('Select a job and Stop it, else Stop all')
+        self.phase, self.progress = QLabel(''), QProgressBar()
+        self.timingbtn = QPushButton(QIcon.fromTheme("office-chart-line"),
+            'Timing Report')
+        self.timingbtn.clicked.connect(lambda: self.show_timings())
         vboxg6 = QVBoxLayout(self.tab6)
         for each_widget in (QLabel('<b>Multiprocess Output Logs'), self.output,
-            self.runbtn, self.stopbt, self.killbt):
+            self.phase, self.progress, QLabel('<b>Jobs'), self.joblist,
+            self.runbtn, self.stopbt, self.killbt, self.timingbtn):
             vboxg6.addWidget(each_widget)
+        self.show_jobs()
 
-        [a.setChecked(True) for a in (self.qckb1, self.qckb2, self.qckb3,
-            self.qckb10, self.qckb11, self.qckb12, self.qckb13, self.qckb14,
-            self.chrt)]
-        self.mainwidget.setCurrentIndex(5)
+    def _make_tab7(self):
+        ' Fleet tab '
+        self.fleetspecs = QTextEdit()
+        self.fleetspecs.setPlainText(FLEETMSG)
+        self.fleetspecs.setToolTip('Other options are taken from the tabs')
+        self.fleetjobs = QSpinBox()
+        self.fleetjobs.setRange(1, 64)
+        self.fleetjobs.setValue(cpu_count())
+        self.fleetbtn = QPushButton(QIcon.fromTheme("media-playback-start"),
+            'Start Vagrant Fleet Now !')
+        self.fleetbtn.setMinimumSize(75, 50)
+        self.fleetbtn.clicked.connect(self.build_fleet)
+        self.fleetkill = QPushButton(QIcon.fromTheme("application-exit"),
+            'Force Kill Fleet')
+        self.fleetkill.clicked.connect(lambda: self.fleet.kill()
+                                       if self.fleet is not None else None)
+        vboxg7 = QVBoxLayout(self.tab7)
+        for each_widget in (QLabel('<b>VM Specs for the Fleet'),
+            self.fleetspecs, QLabel('<b>Max VMs starting at once:'),
+            self.fleetjobs, self.fleetbtn, self.fleetkill):
+            vboxg7.addWidget(each_widget)
+
+    def _make_tab8(self):
+        ' Status tab '
+        self.statusview = QTextEdit()
+        self.statusview.setReadOnly(True)
+        self.statusbtn = QPushButton(QIcon.fromTheme("view-refresh"),
+            'Refresh Status Now')
+        self.statusbtn.clicked.connect(lambda: self.status.refresh(True))
+        self.status = StatusMonitor(self.show_machines)
+        vboxg8 = QVBoxLayout(self.tab8)
+        for each_widget in (QLabel('<b>Vagrant Machines'), self.statusview,
+                            self.statusbtn):
+            vboxg8.addWidget(each_widget)
+
+    def probe_backends(self):
+        ' query backend versions in background, unless cached on disk '
+        self.probes, self.versions, self.probed = {}, {}, time()
+        key, cache = backend_key(BACKENDS), load_json(CACHE, {})
+        if cache.get('backends', {}).get('key') == key:
+            self.versions = cache['backends']['versions']
+            return self._show_backends(True)
+        for binary in BACKENDS:
+            if not which(binary):
+                self.versions[binary] = ''
+                continue
+            process = QProcess()
+            process.finished.connect(lambda c=0, s=0, b=binary:
+                                     self._probe_finished(b))
+            process.error.connect(lambda e=0, b=binary:
+                                  self._probe_finished(b))
+            self.probes[binary] = process
+            process.start(which(binary), ['--version'])
+        if not self.probes:
+            self._show_backends(False)
+
+    def _probe_finished(self, binary):
+        ' collect one backend version, show them when all have finished '
+        process = self.probes.pop(binary, None)
+        if process is None:
+            return
+        process.deleteLater()  # still emitting, Qt frees it after the slot
+        self.versions[binary] = as_text(process.readAllStandardOutput()
+                                        ).strip()
+        if self.probes:
+            return
+        if all(self.versions.values()):
+            save_json(CACHE, dict(load_json(CACHE, {}), backends={
+                'key': backend_key(BACKENDS), 'versions': self.versions}))
+        self._show_backends(False)
+
+    def _show_backends(self, cached):
+        ' show the backend versions on the UI and how long it took to get '
+        if all(self.versions.values()):
+            self.vinfo1.setText('''<b> Vagrant Backend Version: </b> {},
+                <b> VirtualBox Backend Version: </b> {}. '''.format(
+                self.versions['vagrant'], self.versions['vboxmanage']))
+        else:
+            self.vinfo1.setText('<b>Warning: Failed to query Vagrant Backend!')
+        self.vinfo1.setToolTip('Backend Version {} in {:.0f} ms'.format(
+            'cached' if cached else 'queried', (time() - self.probed) * 1000))
+        self.logs.append(self.formatInfoMsg('INFO: ' + self.vinfo1.toolTip()))
 
     def get_de_pkg(self, button):
         ' get package from desktop name '
@@ -324,14 +1031,154 @@ class Main(plugin.Plugin):
             'umbriel', 'titania', 'oberon', 'triton', 'charon', 'orcus', 'io',
             'ixion', 'varuna', 'quaoar', 'sedna', 'methone', 'jupiter', ))
 
-    def readOutput(self):
+    def get_options(self):
+        ' return a dict of VM options from the values of the widgets '
+        self.build_tabs()
+        return dict(DEFAULTS, name=str(self.vmname.text()),
+            codename=str(self.vmcode.currentText()),
+            arch='amd64' if self.vmarch.currentIndex() == 0 else 'i386',
+            protocol=str(self.chttps.currentText()),
+            ports=str(self.portredirect.text()),
+            gui=self.qckb3.isChecked() is True, ram=self.ram.value(),
+            cpu=self.cpu.value(), cpus=self.cpus.value(),
+            aptproxy=str(self.aptproxy.text()),
+            ppa=str(self.aptppa.text()),
+            update=self.qckb10.isChecked() is True,
+            upgrade=self.qckb11.isChecked() is True,
+            aptpkg=str(self.aptpkg.toPlainText()),
+            pippkg=str(self.pippkg.toPlainText()),
+            requirements=str(self.requirements.text()), desktop=self.desktop,
+            boxcache=self.qckb4.isChecked() is True,
+            golden=self.qckb5.isChecked() is True,
+            aptcache=self.qckb15.isChecked() is True,
+            aptcacher=str(self.aptcacher.text()).strip(),
+            wheelhouse=self.qckb16.isChecked() is True,
+            syncmode=str(self.syncmode.currentText()),
+            project=self.current_project() if self.qckb8.isChecked() is True
+            else '')
+
+    def current_project(self):
+        ' return the folder of the current Ninja project, if there is one '
+        project = self.locator.get_service('explorer'
+                                           ).get_current_project_item()
+        return path.abspath(project.path) if project is not None else ''
+
+    def start_aptcacher(self):
+        ' start a local apt-cacher-ng for the VMs, on the host side of NAT '
+        if not which('apt-cacher-ng'):
+            self.logs.append(self.formatErrorMsg('ERROR: No apt-cacher-ng'))
+            return
+        folder = path.join(BASE, 'apt-cacher-ng')
+        if not path.isdir(folder):
+            makedirs(folder)
+        QProcess.startDetached(which('apt-cacher-ng'), ['-c',
+            '/etc/apt-cacher-ng', 'ForeGround=0', 'Port=3142',
+            'CacheDir=' + folder, 'LogDir=' + folder,
+            'PidFile=' + path.join(folder, 'pid')])
+        self.aptcacher.setText('10.0.2.2:3142')
+        self.logs.append(self.formatInfoMsg(
+            'INFO: apt-cacher-ng on port 3142'))
+
+    def refill_pool(self, opts=None):
+        ' fill the warm pool of opts, or of the options shown, up to size '
+        if self.poolsize.value():
+            self.pool.refill(opts or self.get_options(), self.poolsize.value(),
+                self.chrt.isChecked() is True, self.admission
+                if self.qckb7.isChecked() is True else None)
+
+    def build_fleet(self):
+        """Bring up every VM of the Fleet tab, a few at a time"""
+        if self.fleet is not None and self.fleet.running:
+            self.logs.append(self.formatErrorMsg('ERROR: Fleet is running'))
+            return
+        try:
+            specs = check_specs(parse_fleet(self.fleetspecs.toPlainText(),
+                                            self.get_options()))
+        except ValueError as reason:
+            self.logs.append(self.formatErrorMsg('ERROR: Fleet: {}'.format(
+                escape(str(reason)))))
+            return
+        if not specs:
+            self.logs.append(self.formatErrorMsg('ERROR: Fleet is empty'))
+            return
+        self.logs.clear()
+        self.logs.append(self.formatInfoMsg('INFO:{}'.format(datetime.now())))
+        self.logs.append(self.formatInfoMsg('INFO: Fleet of {} VMs, {} at '
+            'once'.format(len(specs), self.fleetjobs.value())))
+        self.fleetbtn.setDisabled(True)
+        self.mainwidget.setCurrentIndex(self.mainwidget.indexOf(self.tab6))
+        self.fleet = Fleet(specs, self.fleetjobs.value(), self.jobs,
+            lambda msg, color='green': self.logs.write(msg, color),
+            self.chrt.isChecked() is True,
+            lambda fleet: self.fleetbtn.setEnabled(True),
+            self.admission if self.qckb7.isChecked() is True else None)
+        self.prepare([a for a in specs if vm_action(a) in ('create',
+                      'rebuild')], self.fleet.start)
+
+    def readOutput(self, job, text):
         """Read and append output to the logBrowser"""
-        self.output.append(str(self.process.readAllStandardOutput()))
+        for kind, line, value in job.parser.feed(text):
+            if job.timer is not None:
+                job.timer.event(kind, line, value)
+            self.show_event(kind, line, value, job.sink)
 
-    def readErrors(self):
+    def show_event(self, kind, text, value, sink):
+        ' show one progress event on the progress bar and the logBrowser '
+        compact = self.qckb6.isChecked() is True
+        if kind == 'download':
+            self.progress.setValue(value)
+            self.phase.setText('<b>Box download: {}%'.format(value))
+            sink.write(text, show=not compact)
+        elif kind == 'phase':
+            self.progress.setValue(0 if value == 'box' else 100)
+            self.phase.setText('<b>Phase: ' + value)
+            sink.append(self.formatInfoMsg(escape(text)))
+        elif kind == 'step':
+            self.phase.setText('<b>Provisioning: {} {}'.format(*value))
+            sink.write(text, 'green' if value[1] == 'done' else 'red')
+        elif kind == 'error':
+            sink.write(text, 'red')
+        elif kind == 'port':
+            sink.append(self.formatInfoMsg(
+                'INFO: Port {} of the VM is on host port {}'.format(*value)))
+        else:
+            sink.write(text, show=not compact)
+
+    def readErrors(self, job, text):
         """Read and append errors to the logBrowser"""
-        self.output.append(self.formatErrorMsg(str(
-                                        self.process.readAllStandardError())))
+        job.sink.write(text, 'red')
+
+    def show_jobs(self):
+        ' list the running and the queued jobs on the Run tab '
+        if self.tab6 in self.makers:
+            return  # not built yet, it lists them when it is
+        self.shownjobs = self.jobs.jobs()
+        self.joblist.clear()
+        for job in self.shownjobs:
+            self.joblist.addItem('{} {} on {}{}'.format(job.state.upper(),
+                job.name, job.folder, ' since {:%H:%M:%S}'.format(job.begin)
+                if job.begin else ''))
+
+    def stop_jobs(self):
+        ' cancel the selected job, or every job if none is selected '
+        row = self.joblist.currentRow()
+        selected = 0 <= row < len(self.shownjobs)
+        if not selected:
+            self.stop_stages()
+        for job in [self.shownjobs[row]] if selected else self.jobs.jobs():
+            self.logs.append(self.formatInfoMsg('INFO: Stopping {} on {}'
+                                                .format(job.name, job.folder)))
+            self.jobs.cancel(job)
+        self.runbtn.setEnabled(True)  # a stopped stage builds no VM
+
+    def stop_stages(self):
+        ' stop the fleet, box caching and golden images, nothing follows '
+        if self.fleet is not None:
+            self.fleet.kill()
+        for stage in self.stages:
+            stage.kill()
+        self.stages = []
+        self.runbtn.setEnabled(True)
 
     def formatErrorMsg(self, msg):
         """Format error messages in red color"""
@@ -343,138 +1190,265 @@ class Main(plugin.Plugin):
 
     def formatMsg(self, msg, color):
         """Format message with the given color"""
-        return '<font color="{}">{}</font>'.format(color, msg)
+        return u'<font color="{}">{}</font>'.format(color, msg)
 
     def build(self):
         """Main function calling vagrant to generate the vm"""
-        self.output.setText('')
-        self.output.append(self.formatInfoMsg('INFO:{}'.format(datetime.now())))
+        self.build_tabs()
+        if self.jobs.idle():
+            self.logs.clear()
+        sink = LogSink(forward=self.logs)  # the .log of this build only
+        sink.append(self.formatInfoMsg('INFO:{}'.format(datetime.now())))
         self.runbtn.setDisabled(True)
-        base = path.join(BASE, self.vmname.text())
+        base, opts = path.join(BASE, self.vmname.text()), self.get_options()
+        handout = self.pool.claim(opts, base) if self.poolsize.value(
+            ) and vm_action(opts, base) == 'create' else ''
+        if handout:
+            sink.append(self.formatInfoMsg('INFO: OK: Warm pool VM {} '
+                'handed out as {}'.format(handout, opts['name'])))
         try:
-            self.output.append(self.formatInfoMsg('INFO: Dir: {}'.format(base)))
+            sink.append(self.formatInfoMsg('INFO: Dir: {}'.format(base)))
             makedirs(base)
         except:
-            self.output.append(self.formatErrorMsg('ERROR:Target Folder Exist'))
-        self.output.append(self.formatInfoMsg('INFO: Changed {}'.format(base)))
-        chdir(base)
-        try:
-            self.output.append(self.formatInfoMsg('INFO:Removing Vagrant file'))
-            remove(path.join(base, 'Vagrantfile'))
-        except:
-            self.output.append(self.formatErrorMsg('ERROR:Remove Vagrant file'))
-        self.output.append(self.formatInfoMsg(' INFO: OK: Runing Vagrant Init'))
-        cmd1 = getoutput('chrt --verbose -i 0 vagrant init', shell=True)
-        self.output.append(self.formatInfoMsg('INFO:OK:Completed Vagrant Init'))
-        self.output.append(self.formatInfoMsg('INFO: Command: {}'.format(cmd1)))
-        cfg = CONFIG.format(self.vmname.text(), self.vmname.text(),
-            self.chttps.currentText(), self.vmcode.currentText(),
-            self.vmcode.currentText(),
-            'amd64' if self.vmarch.currentIndex() is 0 else 'i386',
-            '\n'.join(([
-            '    config.vm.network :forwarded_port, host: {}, guest: {}'.format(
-                a, a) for a in str(self.portredirect.text()).split(',')])),
-            VBOXGUI.format(self.ram.value(), self.cpu.value())
-                if self.qckb3.isChecked() is True else '')
-        self.output.append(self.formatInfoMsg('INFO:OK:Config: {}'.format(cfg)))
-        with open(path.join(base, 'Vagrantfile'), 'w') as f:
-            f.write(cfg)
-            self.output.append(self.formatInfoMsg('INFO: Writing Vagrantfile'))
-            f.close()
-        proxy = APTGET_PROXY.format(self.aptproxy.text(), self.aptproxy.text(),
-            self.aptproxy.text(), self.aptproxy.text(), self.aptproxy.text(),
-            self.aptproxy.text())
-        prv = '\n'.join(('#!/usr/bin/env bash', '# -*- coding: utf-8 -*-',
-        linesep * 2, "PS1='\[\e[1;32m\][\u@\h \W]\$\[\e[0m\] ' ; HISTSIZE=5000",
-        '# Vagrant Bootstrap Provisioning generated by Vagrant Ninja!', linesep,
-        proxy if len(self.aptproxy.text()) >= 5 else '',
-        'add-apt-repository -s -y {}'.format(str(self.aptppa.text()).strip()),
-        'apt-get -V -u -m -y update' if self.qckb10.isChecked() is True else '',
-        'apt-get -y -m dist-upgrade' if self.qckb11.isChecked() is True else '',
-        'apt-get -y -m autoremove' if self.qckb11.isChecked() is True else '',
-        'apt-get -y clean' if self.qckb11.isChecked() is True else '',
-        'dpkg --configure -a' if self.qckb11.isChecked() is True else '',
-        'apt-get -y -f install' if self.qckb11.isChecked() is True else '',
-        'apt-get -y check' if self.qckb11.isChecked() is True else '',
-        'apt-get -y --force-yes install {}'.format(self.aptpkg.toPlainText()),
-        'pip install --verbose {}'.format(self.pippkg.toPlainText()),
-        'pip install --verbose -r {}'.format(self.requirements.text()),
-        'apt-get -y --force-yes -m install {}'.format(self.desktop), linesep,
-        'git config --global user.name "{}"'.format(getuser()),
-        'git config --global color.branch auto',
-        'git config --global color.diff auto',
-        'git config --global color.interactive auto',
-        'git config --global color.status auto',
-        'git config --global credential.helper cache',
-        'git config --global user.email "{}@gmail.com"'.format(getuser()),
-        'git config --global push.default simple',
-        'ufw status ; service ufw stop ; ufw disable ; swapoff --verbose --all',
-        'export LANGUAGE=en_US.UTF-8', 'export LANG=en_US.UTF-8',
-        'export LC_ALL=en_US.UTF-8', 'locale-gen en_US.UTF-8',
-        'dpkg-reconfigure locales', ))
-        self.output.append(self.formatInfoMsg('INFO:OK:Script: {}'.format(prv)))
-        with open(path.join(base, 'bootstrap.sh'), 'w') as f:
-            f.write(prv)
-            self.output.append(self.formatInfoMsg('INFO: Writing bootstrap.sh'))
-            f.close()
-        try:
-            chmod('bootstrap.sh', 0775)  # Py2
-            self.output.append(self.formatInfoMsg('INFO: bootstrap.sh is 775'))
-        except:
-            chmod('bootstrap.sh', 0o775)  # Py3
-            self.output.append(self.formatInfoMsg('INFO: bootstrap.sh is o775'))
-        self.output.append(self.formatInfoMsg(''' INFO: OK:
+            sink.append(self.formatErrorMsg('ERROR:Target Folder Exist'))
+        if self.qckb2.isChecked() is True:
+            sink.open(path.join(base, 'vagrant_ninja.log'))
+            sink.append(self.formatInfoMsg('INFO: OK: Writing .LOG'))
+        timer, action = RunTimer(opts), vm_action(opts, base)
+        sink.append(self.formatInfoMsg('INFO: OK: {}'.format(
+                                                        ACTIONS[action][1])))
+        if action == 'rebuild' and QMessageBox.question(self.dock, __doc__,
+            'The box of {} changed, destroy the VM and create it again ?'
+            .format(opts['name']), QMessageBox.Yes | QMessageBox.No,
+                QMessageBox.No) != QMessageBox.Yes:
+            sink.append(self.formatErrorMsg('ERROR: Not destroying ' + base))
+            sink.close()
+            return self.runbtn.setEnabled(True)
+        if action == 'resume':
+            return self._vagrant_up(opts, timer, sink, action, handout)
+        cfg, prv = render_config(opts), render_bootstrap(opts)
+        sink.append(self.formatInfoMsg('INFO:OK:Config: {}'.format(cfg)))
+        sink.append(self.formatInfoMsg('INFO:OK:Script: {}'.format(prv)))
+        if action not in ('create', 'rebuild'):  # the box is already there
+            return self._vagrant_up(opts, timer, sink, action, handout)
+        self.prepare([opts], lambda: self._vagrant_up(opts, timer, sink,
+                                                      action, handout))
+
+    def prepare(self, specs, then):
+        ' fill box cache and golden images, then call then '
+        def log(msg, color='green'):
+            ' show the messages of the stages on the main log '
+            self.logs.write(msg, color)
+
+        def golden():
+            ' build the missing golden images, if any, then call then '
+            if [a for a in specs if a['golden'] is True and
+                    not golden_box(a)]:
+                return self.stages.append(GoldenBuilder(specs, self.jobs,
+                    log, then, self.chrt.isChecked() is True))
+            then()
+        if [a for a in specs if a['boxcache'] is True and not cached_box(a)]:
+            self.logs.append(self.formatInfoMsg('INFO: Caching the VM boxes'))
+            self.stages.append(BoxFetcher(specs, log, golden))
+        else:
+            golden()
+
+    def _vagrant_up(self, opts, timer, sink, action='create', handout=''):
+        """Run vagrant up for opts, on the cached box if there is one"""
+        fingerprint = vm_fingerprint(opts)
+        if self.qckb7.isChecked() is True:
+            admitted, sized = self.admission.request(opts)
+            if not admitted:
+                sink.append(self.formatInfoMsg('INFO: Held for {}s, {}'
+                                                    .format(ADMITHOLD, sized)))
+                timer.lap('held')
+                QTimer.singleShot(ADMITHOLD * 1000, lambda: self._vagrant_up(
+                    opts, timer, sink, action, handout))
+                return
+            opts = sized
+            sink.append(self.formatInfoMsg('INFO: Sized to {} MB, {} '
+                'cores at {}%'.format(opts['ram'], opts['cpus'], opts['cpu'])))
+        if action == 'resume':
+            base = path.join(BASE, opts['name'])
+        else:
+            base = write_vm(opts)
+            sink.append(self.formatInfoMsg('INFO: Writing Vagrantfile'))
+            sink.append(self.formatInfoMsg('INFO: Writing bootstrap.sh'))
+            sink.append(self.formatInfoMsg('INFO: bootstrap.sh is 775'))
+        if action == 'create':
+            sink.append(self.formatInfoMsg('INFO: Box: {}'.format(
+                                                              box_url(opts))))
+            sink.append(self.formatInfoMsg(''' INFO: OK:
         Vagrant Up needs time, depends on your Internet Connection Speed !'''))
-        self.output.append(self.formatInfoMsg('INFO: OK: Running Vagrant Up !'))
-        self.process.start('{}vagrant up'.format('chrt --verbose -i 0 '
-            if self.chrt.isChecked() is True else ''))
-        if not self.process.waitForStarted():
-            self.output.append(self.formatErrorMsg('ERROR: FAIL: Vagrant Fail'))
-            self.runbtn.setEnabled(True)
-            return
+        sink.append(self.formatInfoMsg('INFO: OK: Running Vagrant {} !'
+                                            .format(ACTIONS[action][0])))
+        timer.lap('up')
+        self.progress.setValue(0)
+        command = 'vagrant {} --machine-readable'.format(ACTIONS[action][0])
+        if action == 'rebuild':
+            command = 'sh -c "vagrant destroy --force && {}"'.format(command)
+        elif handout:  # somebody is waiting, no LOW CPU priority
+            command = 'sh -c "{} && vagrant ssh -c \'{}\'"'.format(
+                command, REHOST.format(opts['name'], handout))
+        job = Job(base, '{}{}'.format('chrt --verbose -i 0 ' if self.chrt
+            .isChecked() is True and not handout else '', command),
+            '{} {}'.format(action, opts['name']), self.readOutput,
+            self.readErrors, self._process_finished)
+        job.timer, job.fingerprint, job.sink = timer, fingerprint, sink
+        self.jobs.submit(job)
         self.runbtn.setEnabled(True)
-        chdir(path.expanduser("~"))
 
-    def _process_finished(self):
+    def _process_finished(self, job, code):
         """finished sucessfully"""
-        self.output.append(self.formatInfoMsg('INFO:{}'.format(datetime.now())))
-        if self.qckb2.isChecked() is True:
-            LOG_FILE = path.join(BASE, self.vmname.text(), 'vagrant_ninja.log')
-            with open(LOG_FILE, 'w') as f:
-                self.output.append(self.formatInfoMsg('INFO: OK: Writing .LOG'))
-                f.write(self.output.toPlainText())
-                f.close()
+        for kind, text, value in job.parser.close():
+            self.show_event(kind, text, value, job.sink)
+        if code != 0:
+            job.sink.append(self.formatErrorMsg('ERROR: FAIL: {} {} on {}'
+                .format(job.name, job.state, job.folder)))
+        elif job.fingerprint is not None:
+            save_json(path.join(job.folder, FINGERPRINT), job.fingerprint)
+        if code == 0 and search(r'vagrant (up|reload|resume)\b', job.command
+                                ) and synced_by_rsync(job.folder):
+            job.sink.append(self.formatInfoMsg('INFO: rsync-auto on ' +
+                                                job.folder))
+            self.autosync.start(job.folder)
+        if job.timer is not None:
+            self.admission.release(job.timer.opts['name'])
+            entry = job.timer.record(code)
+            save_history(entry)
+            job.sink.append(self.formatInfoMsg('INFO: Took {}: {}'.format(
+                duration(entry['total']), ', '.join('{} {}'.format(
+                a, duration(b)) for a, b in sorted(entry['phases'].items())))))
+            self.show_timings('{}/{}'.format(entry['codename'],
+                                             entry['arch']), job.sink)
+            self.refill_pool(job.timer.opts)
+        job.sink.append(self.formatInfoMsg('INFO:{}'.format(datetime.now())))
+        job.sink.close()
         if self.qckb1.isChecked() is True:
-            self.output.append(self.formatInfoMsg('INFO:Opening Target Folder'))
+            job.sink.append(self.formatInfoMsg('INFO:Opening Target Folder'))
             try:
                 startfile(BASE)
             except:
                 Popen(["xdg-open", BASE])
-        chdir(path.expanduser("~"))
+
+    def show_timings(self, profile='', sink=None):
+        ' show the regressions of the build history, for profile or all '
+        sink = sink if sink is not None else self.logs
+        report = regression_report([a for a in load_history() if not profile
+            or '{}/{}'.format(a['codename'], a['arch']) == profile])
+        for kind, line in report or [('info', 'No build timings recorded')]:
+            sink.write('{}: {}'.format(kind.upper(), line),
+                            'red' if kind == 'regression' else 'green')
+
+    def show_machines(self, monitor):
+        ' show every known machine and its state on the Status tab '
+        machines = dict(monitor.machines)
+        for folder in vm_folders():
+            machines.setdefault(path.realpath(folder), {'home': folder,
+                'state': 'not created', 'provider': '', 'id': ''})
+        self.statusview.setHtml('<table>{}</table><br>{}'.format(''.join(
+            '<tr><td><b>{}</b></td><td>{}</td><td>{}</td><td>{}</td></tr>'
+            .format(path.basename(a['home']), self.formatMsg(a['state'],
+            'green' if a['state'] == 'running' else 'gray'), a['provider'],
+            a['home']) for b, a in sorted(machines.items())),
+            'Updated {}'.format(datetime.now())))
+
+    def show_status(self):
+        ' show the cached state of the current project machine '
+        project = self.current_project()
+        self.build_tabs()
+        state = self.status.state(project)
+        self.logs.append(self.formatInfoMsg('INFO: {} is {} (cached {:.0f}s)'
+            .format(project, state, time() - self.status.updated)
+            if self.status.updated else 'INFO: Querying machine states...'))
 
     def vagrant_c(self, option):
         ' run the choosed menu option, kind of quick-mode '
-        self.output.setText('')
-        self.output.append(self.formatInfoMsg('INFO:{}'.format(datetime.now())))
-        self.runbtn.setDisabled(True)
-        chdir(path.abspath(
-          self.locator.get_service('explorer').get_current_project_item().path))
-        self.process.start('chrt --verbose -i 0 vagrant {}'.format(option))
-        if not self.process.waitForStarted():
-            self.output.append(self.formatErrorMsg('ERROR: FAIL: Vagrant Fail'))
-            self.runbtn.setEnabled(True)
-            return
-        self.runbtn.setEnabled(True)
-        self.output.append(self.formatInfoMsg('INFO:{}'.format(datetime.now())))
-        chdir(path.expanduser("~"))
+        self.build_tabs()
+        if self.jobs.idle():
+            self.logs.clear()
+        self.logs.append(self.formatInfoMsg('INFO:{}'.format(datetime.now())))
+        if option in ('halt', 'suspend', 'destroy'):
+            self.autosync.stop(path.realpath(self.current_project()))
+        job = Job(self.current_project(), 'chrt --verbose -i 0 vagrant {}'
+            .format(option), option, self.readOutput, self.readErrors,
+            self._process_finished)
+        job.sink = self.logs
+        self.jobs.submit(job)
+        self.logs.append(self.formatInfoMsg('INFO: {} {} on {}'.format(
+            job.state.capitalize(), option, job.folder)))
 
     def finish(self):
         ' clear when finish '
-        self.process.kill()
+        self.stop_stages()
+        self.jobs.kill()
+        self.autosync.stop()
 
 
 ###############################################################################
 
 
+class BenchLocator(object):
+    " Stand in for the Ninja-IDE service locator, to run Main offline "
+    def get_service(self, name):
+        ' every service is this same do-nothing object '
+        return self
+
+    def add_project_menu(self, menu, lang='all'):
+        ' do not add the menu anywhere '
+
+    def add_widget(self, *args, **kwargs):
+        ' do not add the dock anywhere '
+
+
+def benchmark_build(runs=5, records=20000):
+    ' drive build() against a fake vagrant on a scratch HOME, return times '
+    home = mkdtemp(prefix='vagrant-ninja-bench-')
+    stream = path.join(home, 'stream.txt')
+    fake = path.join(home, 'bin', 'vagrant')
+    makedirs(path.dirname(fake))
+    with open(stream, 'w') as f:
+        f.write(synthetic_stream(records))
+    with open(fake, 'w') as f:
+        f.write(FAKEVAGRANT.format(executable, stream))
+    chmod(fake, 0o755)
+    output = getoutput([executable, path.abspath(__file__), '--bench-child',
+        str(runs)], env=dict(environ, HOME=home, PATH=path.dirname(fake) +
+                             pathsep + environ.get('PATH', '')))
+    return loads(output.decode('utf-8').splitlines()[-1]), path.getsize(stream)
+
+
+def run_benchmark(runs):
+    ' build runs VMs with a fake vagrant on the PATH, return their times '
+    app = QApplication(argv)  # before any widget, kept alive by ninja
+    ninja = Main(BenchLocator())
+    ninja.app = app
+    ninja.initialize()
+    ninja.build_tabs()
+    ninja.vmname.setText('bench')
+    for each_widget in (ninja.qckb1, ninja.qckb4, ninja.qckb5, ninja.qckb7,
+                        ninja.qckb16, ninja.chrt):
+        each_widget.setChecked(False)
+    loop, times = QEventLoop(), []
+    ninja.jobs.changed = lambda: (ninja.show_jobs(), loop.quit() if
+                                  ninja.jobs.idle() else None)
+    for i in range(runs):
+        begin = time()
+        ninja.build()
+        loop.exec_()
+        times.append(round(time() - begin, 3))
+    ninja.finish()
+    return times
+
+
 if __name__ == "__main__":
-    print(__doc__)
+    if '--bench-child' in argv:
+        print(dumps(run_benchmark(int(argv[-1]))))
+    elif '--bench' in argv:
+        times, size = benchmark_build()
+        print('build() on a fake vagrant, {:.1f} MB of output: {}'.format(
+            size / 1048576.0, ', '.join('{:.2f}s'.format(a) for a in times)))
+        print('median {:.2f}s, parser alone {:.1f} MB/s'.format(
+            median(times), benchmark_parser(synthetic_stream(20000))[0]))
+    else:
+        print(__doc__)